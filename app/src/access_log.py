@@ -0,0 +1,188 @@
+"""
+Copyright 2025 5G-AICoder. All Rights Reserved.
+Author: Marios Karagiannopoulos <mkaragiannop@juniper.net>
+Module AccessLog: Pure ASGI access log middleware, per-route timing and a background JSON lines writer.
+"""
+
+# pylint: disable=logging-fstring-interpolation,too-many-statements
+
+import bisect
+import datetime as dt
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+import orjson
+
+from constants import HTTP_HEADER_X_FORWARDED_FOR
+
+logger = logging.getLogger()
+
+# Upper bounds (ms) of the latency histogram buckets kept per route
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    One JSON object per line: the timestamp followed by the fields of the access log entry (a dict message).
+    """
+
+    def format(self, record):
+        entry = {"ts": round(record.created, 6)}
+        if isinstance(record.msg, dict):
+            entry.update(record.msg)
+        else:
+            entry["message"] = record.getMessage()
+        return orjson.dumps(entry).decode()
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that enqueues the record untouched: formatting and serialization happen on the listener thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def start_access_logger(path):
+    """
+    Route the "access" logger to a JSON lines file written by a background thread, so that request handling
+    on the event loop only pays for a queue put. Returns the logger and the started listener (stop() flushes it).
+    """
+    log_queue = queue.SimpleQueue()
+    file_handler = logging.FileHandler(path)
+    file_handler.setFormatter(JsonLinesFormatter())
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=False)
+    access_logger = logging.getLogger("access")
+    access_logger.setLevel(logging.INFO)
+    access_logger.propagate = False
+    for handler in list(access_logger.handlers):
+        access_logger.removeHandler(handler)
+    access_logger.addHandler(_DeferredQueueHandler(log_queue))
+    listener.start()
+    logger.info(f"Access log written to {path}")
+    return access_logger, listener
+
+
+class RouteStats:
+    """
+    Request count, 5xx errors and latency (total, max and histogram) per route template ("GET /v1/search").
+    Keyed by the route template rather than the path, so the number of entries stays bounded.
+    """
+
+    def __init__(self):
+        self.__routes = {}
+        self.__lock = threading.Lock()
+
+    def record(self, route, status_code, duration_ms):
+        bucket = bisect.bisect_left(LATENCY_BUCKETS_MS, duration_ms)
+        with self.__lock:
+            stats = self.__routes.get(route)
+            if stats is None:
+                # count, errors, total ms, max ms, histogram (last bucket counts what exceeds the highest bound)
+                stats = self.__routes[route] = [0, 0, 0.0, 0.0, [0] * (len(LATENCY_BUCKETS_MS) + 1)]
+            stats[0] += 1
+            if status_code >= 500:
+                stats[1] += 1
+            stats[2] += duration_ms
+            stats[3] = max(stats[3], duration_ms)
+            stats[4][bucket] += 1
+
+    @staticmethod
+    def _percentile(histogram, count, fraction):
+        """
+        Upper bound (ms) of the histogram bucket holding the given fraction of the requests,
+        None when it is beyond the highest bucket.
+        """
+        rank = fraction * count
+        seen = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS_MS, histogram):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self):
+        with self.__lock:
+            routes = {route: stats[:4] + [list(stats[4])] for route, stats in self.__routes.items()}
+        return {
+            route: {
+                "requests": count,
+                "errors": errors,
+                "mean_ms": round(total / count, 3),
+                "max_ms": round(slowest, 3),
+                "p50_ms_le": self._percentile(histogram, count, 0.50),
+                "p95_ms_le": self._percentile(histogram, count, 0.95),
+                "p99_ms_le": self._percentile(histogram, count, 0.99),
+            }
+            for route, (count, errors, total, slowest, histogram) in routes.items()
+        }
+
+
+def _client_ip(scope):
+    """
+    Same rule as Utils.get_client_ip, straight from the ASGI scope: X-Forwarded-For unless local, else the peer.
+    """
+    header = HTTP_HEADER_X_FORWARDED_FOR.encode("latin-1")
+    for name, value in scope.get("headers", ()):
+        if name == header:
+            client_ip = value.decode("latin-1")
+            if client_ip not in ("127.0.0.1", "::1", ""):
+                return client_ip
+            break
+    client = scope.get("client")
+    return client[0] if client else ""
+
+
+class AccessLogMiddleware:
+    """
+    Pure ASGI middleware: counts requests per client IP, times every request per route and enqueues one
+    structured access log entry. Unlike BaseHTTPMiddleware, it neither wraps the request nor buffers the
+    response body through an extra task, it only watches the status code going by.
+    """
+
+    def __init__(self, app, access_logger, route_stats, request_counts):
+        self.app = app
+        self.access_logger = access_logger
+        self.route_stats = route_stats
+        self.request_counts = request_counts
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        uid = _client_ip(scope)
+        value = self.request_counts.get(uid)
+        self.request_counts[uid] = (value[0] + 1 if value else 1, dt.datetime.now().isoformat())
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            # The router stores the matched route in the scope, its template keeps the stats cardinality bounded
+            route = scope.get("route")
+            route_key = f"{scope['method']} {route.path if route is not None else UNMATCHED_ROUTE}"
+            self.route_stats.record(route_key, status_code, duration_ms)
+            if self.access_logger.isEnabledFor(logging.INFO):
+                self.access_logger.info(
+                    {
+                        "client": uid,
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "route": route_key.partition(" ")[2],
+                        "status": status_code,
+                        "duration_ms": round(duration_ms, 3),
+                    }
+                )
@@ -4,22 +4,33 @@ Author: Marios Karagiannopoulos <mkaragiannop@juniper.net>
 Module AICoder: The AICoder module.
 """
 
-import os
-import faiss
-import pickle
+import time
 import logging
+import threading
+import numpy as np
+import torch
 
+from concurrent.futures import ThreadPoolExecutor
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from sentence_transformers import SentenceTransformer
-from pathlib import Path
+from symbol_index import hybrid_rank
+from index_shard import configured_index_shards
+from kv_cache import ConversationState, PrefixKVCache, conversation_key, kv_cache_bytes_per_token
+from profiling import trace_region, torch_trace
+from index_builder import IndexBuilder, IndexArtifactError, check_embedding_dim, load_index_artifact
 
 from constants import (
-    AICODER_5GCODE_PATH,
-    AICODER_FAISS_INDEX_FOLDER,
-    AICODER_FAISS_INDEX_FILE,
-    AICODER_FAISS_INDEX_CHUNKS_FILE,
     HUGGINGFACE_TOKEN,
-    AICODER_5GCODE_EXTENSIONS,
+    AICODER_EMBEDDING_BATCH_SIZE,
+    AICODER_INDEX_BUILD_ON_STARTUP,
+    AICODER_HYBRID_LEXICAL_WEIGHT,
+    AICODER_HYBRID_CANDIDATES_FACTOR,
+    AICODER_SHARD_SEARCH_WORKERS,
+    AICODER_KV_CACHE_MAX_BYTES,
+    AICODER_MAX_PROMPT_TOKENS,
+    AICODER_MAX_NEW_TOKENS,
+    AICODER_KV_CACHE_CONVERSATIONS,
+    AICODER_GENERATION_CONCURRENCY,
     LLMModels,
 )
 
@@ -30,137 +41,477 @@ class AICoder:
     def __init__(self):
         """
         Initialize the AICoder object.
+        Nothing is loaded here, start() loads the models and indexes in the background.
         """
         logger.info("Initializing AICoder...")
-        # time.sleep(500)
-        # Step 1: Check if FAISS index exists or create it
-        logger.info("Checking for existing FAISS index...")
-        # Ensure the folder exists
-        Path(AICODER_FAISS_INDEX_FOLDER).mkdir(parents=True, exist_ok=True)
-        self.__embedding_model = SentenceTransformer(LLMModels.EMBEDDING_MODEL.value)
-        self._check_faiss_index()
-        # Step 2: Load the LLM and tokenizer
-        logger.info("Loading LLM and tokenizer...")
-        self.__tokenizer = AutoTokenizer.from_pretrained(
+        self.__shards = {shard.name: shard for shard in configured_index_shards()}
+        # FAISS releases the GIL while searching, so the shards are searched in parallel threads
+        self.__shard_executor = ThreadPoolExecutor(
+            max_workers=min(len(self.__shards), AICODER_SHARD_SEARCH_WORKERS), thread_name_prefix="shard-search"
+        )
+        self.__embedding_model = None
+        self.__index_builder = None
+        self.__tokenizer = None
+        self.__model = None
+        self.__kv_cache = PrefixKVCache(AICODER_KV_CACHE_MAX_BYTES)
+        # Concurrent generations only compete for the same cores (or GPU), bound them
+        self.__generation_slots = threading.BoundedSemaphore(AICODER_GENERATION_CONCURRENCY)
+        components = ["embedding_model", "tokenizer", "llm"] + [f"index:{name}" for name in self.__shards]
+        self.__components = {name: {"status": "pending", "seconds": None, "error": None} for name in components}
+        self.__startup_thread = None
+        self.__startup_started = None
+        self.__startup_seconds = None
+
+    def start(self):
+        """
+        Load the embedding model, the tokenizer, the LLM and the index of every shard concurrently, in the background.
+        Returns immediately: cold start is bounded by the slowest component rather than the sum of all of them.
+        """
+        if self.__startup_thread is not None:
+            return
+        self.__startup_started = time.perf_counter()
+        self.__startup_thread = threading.Thread(target=self._load_components, name="aicoder-startup", daemon=True)
+        self.__startup_thread.start()
+
+    def _load_components(self):
+        with ThreadPoolExecutor(max_workers=len(self.__components), thread_name_prefix="aicoder-startup") as executor:
+            embedding_model_loaded = executor.submit(self._load_component, "embedding_model", self._load_embedding_model)
+            futures = [
+                embedding_model_loaded,
+                executor.submit(self._load_component, "tokenizer", self._load_tokenizer),
+                executor.submit(self._load_component, "llm", self._load_llm),
+            ]
+            futures.extend(
+                executor.submit(self._load_component, f"index:{shard.name}", self._load_index, shard, embedding_model_loaded)
+                for shard in self.__shards.values()
+            )
+            loaded = all(future.result() for future in futures)
+        self.__startup_seconds = round(time.perf_counter() - self.__startup_started, 3)
+        if loaded:
+            logger.info(f"AICoder initialized in {self.__startup_seconds}s: {self.__components}")
+        else:
+            logger.error(f"AICoder failed to initialize ({self.startup_status()['status']}): {self.__components}")
+
+    def _load_component(self, name, loader, *args):
+        """
+        Run the loader of a component, recording its status and duration. Returns True once loaded.
+        """
+        component = self.__components[name]
+        component["status"] = "loading"
+        start_time = time.perf_counter()
+        try:
+            loader(*args)
+            component["status"] = "ready"
+            return True
+        except Exception as e:
+            logger.error(f"Loading {name} failed: {e}")
+            component["status"] = "failed"
+            component["error"] = str(e)
+            return False
+        finally:
+            component["seconds"] = round(time.perf_counter() - start_time, 3)
+            logger.info(f"Component {name}: {component['status']} in {component['seconds']}s")
+
+    # The _create_* methods only instantiate the models, subclasses override them to serve other models
+    # (e.g. the deterministic stubs of benchmarks/load_test.py)
+    def _create_embedding_model(self):
+        return SentenceTransformer(LLMModels.EMBEDDING_MODEL.value)
+
+    def _create_tokenizer(self):
+        return AutoTokenizer.from_pretrained(
             LLMModels.QUERIES_MODEL.value, token=HUGGINGFACE_TOKEN, resume_download=True, trust_remote_code=True
         )
-        self.__model = AutoModelForCausalLM.from_pretrained(
+
+    def _create_llm(self):
+        return AutoModelForCausalLM.from_pretrained(
             LLMModels.QUERIES_MODEL.value, token=HUGGINGFACE_TOKEN, trust_remote_code=True
         )
 
-        logger.info("AICoder initialized.")
-
-    def _check_faiss_index(self):
-        self.__index, self.__chunks = self._load_faiss_index(AICODER_FAISS_INDEX_FILE)
-        if self.__index is None or self.__chunks is None:
-            logger.info(f"Index not found under '{AICODER_FAISS_INDEX_FILE}'. Extracting and chunking repository data...")
-            self.__chunks = self._extract_and_chunk(AICODER_5GCODE_PATH)
-            logger.info(f"Total chunks extracted: {len(self.__chunks)}")
-            logger.info(f"Creating FAISS index under '{AICODER_FAISS_INDEX_FILE}'...")
-            self.__index = self._create_faiss_index(self.__chunks, self.__embedding_model, AICODER_FAISS_INDEX_FILE)
-            logger.info("FAISS index created and saved to disk.")
-        else:
-            logger.info("FAISS index loaded from disk.")
+    def _load_embedding_model(self):
+        embedding_model = self._create_embedding_model()
+        self.__index_builder = IndexBuilder(embedding_model)
+        self.__embedding_model = embedding_model
+
+    def _load_tokenizer(self):
+        self.__tokenizer = self._create_tokenizer()
 
-    # Step 1: Extract and chunk repository data
-    def _extract_and_chunk(self, repo_path, chunk_size=500):
+    def _load_llm(self):
+        llm_model = self._create_llm()
+        config = getattr(llm_model, "config", None)
+        if not AICODER_KV_CACHE_MAX_BYTES and config is not None:
+            # Room for a few conversations at full length, so that the cache still helps on long follow-ups
+            bytes_per_token = kv_cache_bytes_per_token(config, torch.empty((), dtype=llm_model.dtype).element_size())
+            max_tokens = AICODER_MAX_PROMPT_TOKENS + AICODER_MAX_NEW_TOKENS
+            self.__kv_cache.resize(bytes_per_token * max_tokens * AICODER_KV_CACHE_CONVERSATIONS)
+            logger.info(
+                f"KV cache: {bytes_per_token} bytes per token, sized for {AICODER_KV_CACHE_CONVERSATIONS} conversations "
+                f"of {max_tokens} tokens ({self.__kv_cache.stats()['max_bytes']} bytes)"
+            )
+        elif not AICODER_KV_CACHE_MAX_BYTES:
+            logger.warning("The LLM has no config to size the KV cache from, set AICODER_KV_CACHE_MAX_BYTES to enable it")
+        self.__model = llm_model
+
+    def _load_index(self, shard, embedding_model_loaded=None):
         """
-        Extract and chunk repository data into smaller pieces.
+        Load and verify the current index version of a shard, built offline by index_builder.py.
+        Refuses (IndexArtifactError) a missing index, unless AICODER_INDEX_BUILD_ON_STARTUP is set, and an index
+        built with another embedding model.
+        At startup the artifact is read while the embedding model loads, embedding_model_loaded is the future
+        to wait for before checking the embedding dimension.
         """
-        chunks = []
-        allowed_extensions = tuple(AICODER_5GCODE_EXTENSIONS.split(","))
-        for root, dirs, files in os.walk(repo_path):
-            for file in files:
-                if file.endswith(allowed_extensions):
-                    with open(os.path.join(root, file), "r", encoding="utf-8") as f:
-                        content = f.read()
-                        for i in range(0, len(content), chunk_size):
-                            chunks.append(content[i : i + chunk_size])
-        return chunks
+        loaded = load_index_artifact(shard)
+        if embedding_model_loaded is not None and not embedding_model_loaded.result():
+            raise IndexArtifactError(f"Shard '{shard.name}': the embedding model failed to load")
+        embedding_dim = self.__embedding_model.get_sentence_embedding_dimension()
+        if loaded is None:
+            if not AICODER_INDEX_BUILD_ON_STARTUP:
+                raise IndexArtifactError(
+                    f"No index found for shard '{shard.name}' under '{shard.index_folder}'. "
+                    f"Build it with: python3 src/index_builder.py --shard {shard.name}"
+                )
+            logger.info(f"Index of shard '{shard.name}' not found, building it (AICODER_INDEX_BUILD_ON_STARTUP)...")
+            self.__index_builder.build(shard)
+            loaded = load_index_artifact(shard)
+        check_embedding_dim(shard, loaded[1], embedding_dim)
+        shard.data, shard.manifest = loaded
+        logger.info(f"Index version '{shard.manifest['version']}' of shard '{shard.name}' loaded and verified.")
 
-    # Step 2: Index the repository data using FAISS
-    def _create_faiss_index(self, chunks, embedding_model, index_path):
+    def index_components(self, shard_names=None):
         """
-        Create a FAISS index for the repository chunks and save it to disk.
+        Names of the index components of the given shards, of every shard by default.
         """
-        # Generate embeddings
-        embeddings = embedding_model.encode(chunks)
+        return [f"index:{shard.name}" for shard in self.select_shards(shard_names)]
 
-        # Create the FAISS index
-        index = faiss.IndexFlatL2(embeddings.shape[1])  # L2 distance index
-        index.add(embeddings)
+    def components_ready(self, *names):
+        """
+        True once the given components are loaded, all of them when none given.
+        """
+        return all(self.__components[name]["status"] == "ready" for name in names or self.__components)
 
-        # Save the index and chunks to disk
-        faiss.write_index(index, index_path)
-        with open(AICODER_FAISS_INDEX_CHUNKS_FILE, "wb") as f:
-            pickle.dump(chunks, f)
+    def startup_status(self):
+        """
+        Startup state with the status, duration and error of every component: "failed" when a model or every
+        shard index failed to load, "degraded" when only some shard indexes did (the other shards serve, a
+        retrain recovers them), else "starting" until everything is "ready".
+        """
+        statuses = {name: component["status"] for name, component in self.__components.items()}
+        index_statuses = [status for name, status in statuses.items() if name.startswith("index:")]
+        model_statuses = [status for name, status in statuses.items() if not name.startswith("index:")]
+        if "failed" in model_statuses or all(status == "failed" for status in index_statuses):
+            state = "failed"
+        elif any(status in ("pending", "loading") for status in statuses.values()):
+            state = "starting"
+        elif "failed" in index_statuses:
+            state = "degraded"
+        else:
+            state = "ready"
+        elapsed = None
+        if self.__startup_started is not None:
+            elapsed = self.__startup_seconds or round(time.perf_counter() - self.__startup_started, 3)
+        return {
+            "status": state,
+            "startup_seconds": elapsed,
+            "components": {name: dict(component) for name, component in self.__components.items()},
+        }
 
-        return index
+    def _shard_candidates(self, shard_data, queries, query_embeddings, num_candidates):
+        """
+        Dense and lexical candidates of one shard for a batch of embedded queries.
+        Returns, for each query, {chunk_id: (distance, lexical score, match)}.
+        """
+        index, _, _, symbol_index = shard_data
+        distances, indices = index.search(query_embeddings, k=num_candidates)
+        results = []
+        for query, query_embedding, query_distances, query_indices in zip(queries, query_embeddings, distances, indices):
+            lexical_scores = symbol_index.lexical_scores(query, num_candidates)
+            # Chunks defining a symbol the query may name (e.g. the UPF macro) compete with the top lexical score
+            for chunk_id in symbol_index.symbol_candidates(query, num_candidates):
+                lexical_scores[chunk_id] = 1.0
+            # FAISS pads with -1 when the index holds fewer than num_candidates vectors
+            candidates = {
+                int(i): (float(distance), lexical_scores.get(int(i), 0.0), "hybrid" if int(i) in lexical_scores else "dense")
+                for distance, i in zip(query_distances, query_indices)
+                if i >= 0
+            }
+            lexical_only_ids = [chunk_id for chunk_id in lexical_scores if chunk_id not in candidates]
+            if lexical_only_ids:
+                # Exact distance of the lexical only candidates from their stored vectors
+                vectors = index.reconstruct_batch(np.array(lexical_only_ids, dtype=np.int64))
+                lexical_distances = ((vectors - query_embedding) ** 2).sum(axis=1)
+                for chunk_id, distance in zip(lexical_only_ids, lexical_distances):
+                    candidates[chunk_id] = (float(distance), lexical_scores[chunk_id], "lexical")
+            results.append(candidates)
+        return results
 
-    # Step 3: Load FAISS index from disk
-    def _load_faiss_index(self, index_path):
+    def _retrieve_chunks(self, queries, shards, embedding_model, k):
         """
-        Load a FAISS index and corresponding chunks from disk.
+        Hybrid retrieval for a batch of queries over the given shards.
+        Queries naming a symbol unambiguously (backticked, or its exact snake_case/camelCase name) short-circuit
+        to the chunks defining it, skipping the embedding model.
+        The others are embedded once and fanned out to every shard in parallel, and the dense and lexical
+        candidates of all shards are fused into one global top k.
+        Returns, for each query, a list of (shard name, chunk, chunk location, distance, score, match).
         """
-        if not os.path.exists(index_path) or not os.path.exists(AICODER_FAISS_INDEX_CHUNKS_FILE):
-            return None, None
+        # Snapshot the data of each shard, a concurrent retrain swaps it as a whole
+        shard_data = [(shard, shard.data) for shard in shards]
+        results = [None] * len(queries)
+        dense_queries = []
+        for n, query in enumerate(queries):
+            symbol_hits = [
+                (shard.name, data[1][chunk_id], data[2][chunk_id], None, 1.0, "symbol")
+                for shard, data in shard_data
+                for chunk_id in data[3].lookup_symbols(query, k)
+            ]
+            if symbol_hits:
+                results[n] = symbol_hits[:k]
+            else:
+                dense_queries.append(n)
+        if not dense_queries:
+            return results
 
-        # Load the FAISS index
-        index = faiss.read_index(index_path)
+        num_candidates = k * AICODER_HYBRID_CANDIDATES_FACTOR
+        dense_texts = [queries[n] for n in dense_queries]
+        with trace_region("embed_queries"):
+            query_embeddings = embedding_model.encode(
+                dense_texts, batch_size=AICODER_EMBEDDING_BATCH_SIZE, convert_to_numpy=True, show_progress_bar=False
+            )
+        with trace_region("search_shards"):
+            if len(shard_data) == 1:
+                shard_results = [self._shard_candidates(shard_data[0][1], dense_texts, query_embeddings, num_candidates)]
+            else:
+                futures = [
+                    self.__shard_executor.submit(self._shard_candidates, data, dense_texts, query_embeddings, num_candidates)
+                    for _, data in shard_data
+                ]
+                shard_results = [future.result() for future in futures]
 
-        # Load the chunks
-        with open(AICODER_FAISS_INDEX_CHUNKS_FILE, "rb") as f:
-            chunks = pickle.load(f)
+        for position, n in enumerate(dense_queries):
+            # Global merge: the candidates of all shards are ranked together, distances share one embedding space
+            candidates = {}
+            matches = {}
+            for shard_position, candidates_per_query in enumerate(shard_results):
+                for chunk_id, (distance, lexical_score, match) in candidates_per_query[position].items():
+                    candidates[(shard_position, chunk_id)] = (distance, lexical_score)
+                    matches[(shard_position, chunk_id)] = match
+            hits = []
+            for (shard_position, chunk_id), distance, score in hybrid_rank(candidates, k, AICODER_HYBRID_LEXICAL_WEIGHT):
+                shard, data = shard_data[shard_position]
+                hits.append(
+                    (shard.name, data[1][chunk_id], data[2][chunk_id], distance, score, matches[(shard_position, chunk_id)])
+                )
+            results[n] = hits
+        return results
 
-        return index, chunks
+    def _render_prompt(self, messages, tokenizer):
+        """
+        Token ids of the conversation rendered with the chat template of the LLM, ready for the assistant turn.
+        """
+        if getattr(tokenizer, "chat_template", None):
+            return tokenizer.apply_chat_template(messages, add_generation_prompt=True, return_tensors="pt", return_dict=False)
+        text = "".join(f"{message['role'].capitalize()}: {message['content']}\n" for message in messages) + "Assistant: "
+        return tokenizer(text, return_tensors="pt").input_ids
 
     # Step 4: Retrieve relevant chunks and generate a response
-    def _retrieve_and_generate(self, query, index, chunks, embedding_model, llm_model, tokenizer):
+    def _retrieve_and_generate(self, messages, shards, embedding_model, llm_model, tokenizer, max_new_tokens):
         """
-        Retrieve relevant chunks and generate a response using the LLM.
+        Retrieve relevant chunks and generate a response using the LLM, for the last user message of a conversation.
+        When the KV cache of the previous turn is known, only the tokens after the shared prompt prefix are prefilled.
+        Returns the response and the token usage.
         """
-        # Embed the query
-        query_embedding = embedding_model.encode([query])
-        distances, indices = index.search(query_embedding, k=5)  # Retrieve top 5 chunks
-        relevant_chunks = [chunks[i] for i in indices[0]]
+        # Follow-up questions ("and who calls it?") only make sense together with the previous question
+        user_turns = [message["content"] for message in messages if message["role"] == "user"]
+        query = "\n".join(user_turns[-2:])
+        # Retrieve top 5 chunks, or only the chunks defining the symbols named in the query
+        with trace_region("retrieve"):
+            hits = self._retrieve_chunks([query], shards, embedding_model, k=5)[0]
+        relevant_chunks = [chunk for _, chunk, _, _, _, _ in hits]
         context = "\n".join(relevant_chunks)
 
         # Prepare the input for the LLM
-        input_text = f"Context:\n{context}\n\nQuestion: {query}"
-        inputs = tokenizer(input_text, return_tensors="pt", truncation=True, max_length=1024)
+        state = self.__kv_cache.take(conversation_key(messages[:-1])) if len(messages) > 1 else None
+        # Earlier turns are replayed exactly as the LLM saw them (retrieved context included),
+        # so that the prompt starts with the tokens held by the cached KV
+        prompt_messages = list(state.messages) if state is not None else list(messages[:-1])
+        prompt_messages.append({"role": "user", "content": f"Context:\n{context}\n\nQuestion: {messages[-1]['content']}"})
+        with trace_region("tokenize"):
+            input_ids = self._render_prompt(prompt_messages, tokenizer)
+            while input_ids.shape[1] > AICODER_MAX_PROMPT_TOKENS:
+                # Drop the oldest exchanges, system prompts excepted, until the prompt fits: a user turn goes
+                # together with the assistant replies up to the next user turn, so that no reply is left orphaned
+                droppable = [n for n, message in enumerate(prompt_messages[:-1]) if message["role"] != "system"]
+                if not droppable:
+                    input_ids = input_ids[:, -AICODER_MAX_PROMPT_TOKENS:]
+                    break
+                end = next((n for n in droppable[1:] if prompt_messages[n]["role"] == "user"), len(prompt_messages) - 1)
+                prompt_messages = [message for n, message in enumerate(prompt_messages) if n not in droppable or n >= end]
+                input_ids = self._render_prompt(prompt_messages, tokenizer)
+
+        past_key_values = None
+        cached_tokens = 0
+        if state is not None:
+            # At least the last prompt token has to go through the model to start generating
+            limit = min(len(state.token_ids), input_ids.shape[1] - 1)
+            mismatches = (state.token_ids[:limit] != input_ids[0, :limit]).nonzero()
+            cached_tokens = int(mismatches[0]) if len(mismatches) else limit
+            if cached_tokens > 0:
+                past_key_values = state.past_key_values
+                past_key_values.crop(cached_tokens)
+        logger.debug(f"Prompt tokens: {input_ids.shape[1]}, reused from the KV cache: {cached_tokens}")
 
         # Generate the response
-        outputs = llm_model.generate(
-            **inputs,
-            max_new_tokens=2000,  # Limit the response length
-            pad_token_id=tokenizer.eos_token_id,  # Avoid warnings about padding
+        with trace_region("generate"):
+            outputs = llm_model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past_key_values,
+                max_new_tokens=max_new_tokens,  # Limit the response length
+                pad_token_id=tokenizer.eos_token_id,  # Avoid warnings about padding
+                use_cache=True,
+                return_dict_in_generate=True,
+            )
+        sequence = outputs.sequences[0]
+        with trace_region("decode"):
+            response = tokenizer.decode(sequence[input_ids.shape[1] :], skip_special_tokens=True)
+
+        # Keep the KV cache for the next turn, which continues this conversation with this response
+        kv = outputs.past_key_values
+        if kv is not None and hasattr(kv, "crop"):
+            prompt_messages.append({"role": "assistant", "content": response})
+            self.__kv_cache.put(
+                conversation_key(messages + [{"role": "assistant", "content": response}]),
+                ConversationState(prompt_messages, sequence[: kv.get_seq_length()], kv),
+            )
+        completion_tokens = len(sequence) - input_ids.shape[1]
+        usage = {
+            "prompt_tokens": input_ids.shape[1],
+            "completion_tokens": completion_tokens,
+            "total_tokens": input_ids.shape[1] + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        return response, usage
+
+    @property
+    def shard_names(self):
+        return list(self.__shards)
+
+    def select_shards(self, names=None):
+        """
+        Resolve shard names to shards, all of them when names is empty. Raises ValueError on unknown names.
+        """
+        if not names:
+            return list(self.__shards.values())
+        unknown = [name for name in names if name not in self.__shards]
+        if unknown:
+            raise ValueError(f"Unknown index shard(s): {', '.join(unknown)}. Available: {', '.join(self.__shards)}")
+        return [self.__shards[name] for name in dict.fromkeys(names)]
+
+    def search_aicoder(self, queries, k=5, shard_names=None):
+        """
+        Retrieval only: return the k best chunks for each query, without running the LLM.
+        """
+        results = self._retrieve_chunks(queries, self.select_shards(shard_names), self.__embedding_model, k)
+        return [
+            [
+                {
+                    "shard": shard_name,
+                    "text": chunk,
+                    **location,
+                    "distance": distance,
+                    "score": score,
+                    "match": match,
+                }
+                for shard_name, chunk, location, distance, score, match in hits
+            ]
+            for hits in results
+        ]
+
+    def embed_texts(self, texts):
+        """
+        Encode a list of texts with the loaded embedding model.
+        Returns the float32 embeddings and the number of tokens consumed per text.
+        """
+        embeddings = self.__embedding_model.encode(
+            texts, batch_size=AICODER_EMBEDDING_BATCH_SIZE, convert_to_numpy=True, show_progress_bar=False
         )
-        response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        return response
+        # One pass of the fast tokenizer, truncated like encode() and without padding, masks or tensors
+        token_ids = self.__embedding_model.tokenizer(
+            texts,
+            add_special_tokens=True,
+            truncation=True,
+            max_length=self.__embedding_model.max_seq_length,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )["input_ids"]
+        token_counts = [len(ids) for ids in token_ids]
+        return embeddings.astype(np.float32, copy=False), token_counts
+
+    @property
+    def kv_cache_stats(self):
+        return self.__kv_cache.stats()
+
+    @property
+    def build_stats(self):
+        return {
+            name: {"version": shard.manifest.get("version"), **shard.manifest.get("build_stats", {})}
+            for name, shard in self.__shards.items()
+        }
 
-    def retrain_aicoder(self):
+    def retrain_aicoder(self, shard_names=None):
+        """
+        Build a new index version of the given shards (all of them by default), one after the other.
+        The other shards, and a shard's previous version until the new one is verified and loaded, keep serving.
+        """
         try:
-            # Delete the existing index and chunks
-            if os.path.exists(AICODER_FAISS_INDEX_FILE):
-                os.remove(AICODER_FAISS_INDEX_FILE)
-            if os.path.exists(AICODER_FAISS_INDEX_CHUNKS_FILE):
-                os.remove(AICODER_FAISS_INDEX_CHUNKS_FILE)
-            self._check_faiss_index()
+            for shard in self.select_shards(shard_names):
+                with shard.retrain_lock:
+                    self.__index_builder.build(shard)
+                    self._load_index(shard)
+                    # A shard whose index failed to load at startup is recovered by its retrain
+                    self.__components[f"index:{shard.name}"].update(status="ready", error=None)
             return True
         except Exception as e:
             logger.error(f"An error occurred: {e}")
             return False
 
     # Main function to run the RAG pipeline
-    def ask_aicoder(self, question):
+    def chat_aicoder(self, messages, shard_names=None, max_new_tokens=None):
+        """
+        Answer the last user message of a conversation ([{"role": ..., "content": ...}, ...]).
+        Returns the response and the token usage, or None on error.
+        """
         try:
             # Step 3: Query the model
             logger.info("Generating response...")
-            response = self._retrieve_and_generate(
-                question, self.__index, self.__chunks, self.__embedding_model, self.__model, self.__tokenizer
-            )
+            with self.__generation_slots:
+                response, usage = self._retrieve_and_generate(
+                    messages,
+                    self.select_shards(shard_names),
+                    self.__embedding_model,
+                    self.__model,
+                    self.__tokenizer,
+                    max_new_tokens or AICODER_MAX_NEW_TOKENS,
+                )
             logger.info(f"\nResponse:\n{response}")
-            return response
+            return response, usage
         except Exception as e:
             logger.error(f"An error occurred: {e}")
             return None
+
+    def trace_aicoder(self, messages, trace_file, shard_names=None, max_new_tokens=None):
+        """
+        Answer like chat_aicoder, under the torch profiler: writes a Chrome trace of the retrieval, tokenization,
+        generation and decoding of this one call to trace_file. Errors are raised.
+        """
+        with self.__generation_slots, torch_trace(trace_file):
+            return self._retrieve_and_generate(
+                messages,
+                self.select_shards(shard_names),
+                self.__embedding_model,
+                self.__model,
+                self.__tokenizer,
+                max_new_tokens or AICODER_MAX_NEW_TOKENS,
+            )
+
+    def ask_aicoder(self, question, shard_names=None):
+        result = self.chat_aicoder([{"role": "user", "content": question}], shard_names)
+        return result[0] if result else None
@@ -0,0 +1,97 @@
+"""
+Copyright 2025 5G-AICoder. All Rights Reserved.
+Author: Marios Karagiannopoulos <mkaragiannop@juniper.net>
+Module ChunkDeduplicator: Exact and near-duplicate detection of repository chunks.
+"""
+
+# pylint: disable=logging-fstring-interpolation,too-many-statements
+
+import os
+import re
+import zlib
+import hashlib
+import fnmatch
+import numpy as np
+
+SHINGLE_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+SHINGLE_SIZE = 3
+MINHASH_NUM_PERM = 128
+MINHASH_BANDS = 32  # 32 bands of 4 rows: candidates from ~0.5 Jaccard upwards, verified against the threshold
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def is_excluded(relative_path, exclude_globs):
+    """
+    True if a repository relative path matches one of the exclusion globs.
+    Paths are also tried with a leading '/' so that '*/vendor/*' matches a top-level vendor folder.
+    """
+    relative_path = relative_path.replace(os.sep, "/")
+    return any(
+        fnmatch.fnmatchcase(relative_path, pattern) or fnmatch.fnmatchcase("/" + relative_path, pattern)
+        for pattern in exclude_globs
+    )
+
+
+class ChunkDeduplicator:
+    """
+    Assigns one chunk id per distinct chunk content, so that one vector serves every location of that content.
+    Exact duplicates are detected by content hash. When near_duplicate_threshold is set (0 < t <= 1), chunks whose
+    estimated Jaccard similarity (MinHash over token shingles, LSH banding) reaches it are mapped to the first one.
+    """
+
+    def __init__(self, near_duplicate_threshold=0.0, seed=5):
+        self.__hashes = {}  # content hash -> (chunk id, duplicate kind of later copies)
+        self.__near_duplicate_threshold = near_duplicate_threshold
+        if near_duplicate_threshold > 0:
+            generator = np.random.default_rng(seed)
+            # a * h + b stays below 2**64 for 32 bit shingle hashes
+            self.__perm_a = generator.integers(1, 1 << 31, size=MINHASH_NUM_PERM, dtype=np.uint64)
+            self.__perm_b = generator.integers(0, 1 << 31, size=MINHASH_NUM_PERM, dtype=np.uint64)
+            self.__signatures = {}  # chunk id -> MinHash signature
+            self.__buckets = [{} for _ in range(MINHASH_BANDS)]  # band -> band signature -> chunk ids
+
+    def _minhash(self, text):
+        tokens = SHINGLE_TOKEN_PATTERN.findall(text)
+        shingles = {" ".join(tokens[i : i + SHINGLE_SIZE]) for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))}
+        # CRC32 rather than the builtin hash, which is salted per process: the same corpus gives the same signatures
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles)
+        )
+        permuted = (np.outer(hashes, self.__perm_a) + self.__perm_b) % np.uint64(MERSENNE_PRIME)
+        return (permuted & np.uint64(MAX_HASH)).min(axis=0)
+
+    def assign(self, text, next_chunk_id):
+        """
+        Return (chunk_id, kind) for a chunk: kind is "exact" or "near" when it duplicates an already
+        assigned chunk, or None when the content is new and was given next_chunk_id.
+        """
+        content_hash = hashlib.sha1(text.encode("utf-8"), usedforsecurity=False).digest()
+        known = self.__hashes.get(content_hash)
+        if known is not None:
+            return known
+        if self.__near_duplicate_threshold <= 0:
+            self.__hashes[content_hash] = (next_chunk_id, "exact")
+            return next_chunk_id, None
+
+        signature = self._minhash(text)
+        rows = MINHASH_NUM_PERM // MINHASH_BANDS
+        band_keys = [signature[band * rows : (band + 1) * rows].tobytes() for band in range(MINHASH_BANDS)]
+        candidates = set()
+        for band, band_key in enumerate(band_keys):
+            candidates.update(self.__buckets[band].get(band_key, ()))
+        best_id, best_similarity = None, 0.0
+        for candidate_id in candidates:
+            similarity = float(np.mean(self.__signatures[candidate_id] == signature))
+            if similarity > best_similarity:
+                best_id, best_similarity = candidate_id, similarity
+        if best_id is not None and best_similarity >= self.__near_duplicate_threshold:
+            # Later copies of this text resolve to the same chunk without hashing shingles again
+            self.__hashes[content_hash] = (best_id, "near")
+            return best_id, "near"
+
+        self.__hashes[content_hash] = (next_chunk_id, "exact")
+        self.__signatures[next_chunk_id] = signature
+        for band, band_key in enumerate(band_keys):
+            self.__buckets[band].setdefault(band_key, []).append(next_chunk_id)
+        return next_chunk_id, None
@@ -33,12 +33,54 @@ AICODER_HTTP_PORT = os.environ.get("AICODER_HTTP_PORT", 9443)
 
 AICODER_5GCODE_PATH = os.environ.get("AICODER_5GCODE_PATH", None)
 AICODER_5GCODE_EXTENSIONS = os.environ.get("AICODER_5GCODE_EXTENSIONS", None)
+# Comma separated globs (relative to AICODER_5GCODE_PATH) of generated or vendored files to leave out of the index
+AICODER_5GCODE_EXCLUDE_GLOBS = os.environ.get(
+    "AICODER_5GCODE_EXCLUDE_GLOBS",
+    "*_pb2.py,*_pb2_grpc.py,*.pb.go,*.pb.h,*.pb.cc,*.min.js,*/vendor/*,*/third_party/*,*/node_modules/*,*/generated/*",
+)
+# Estimated Jaccard similarity above which chunks share one vector (MinHash), 0 disables near-duplicate detection
+AICODER_NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("AICODER_NEAR_DUPLICATE_THRESHOLD", 0))
+# Duplicate locations stored per chunk (all of them are counted), -1 stores them all
+AICODER_MAX_DUPLICATE_LOCATIONS = int(os.environ.get("AICODER_MAX_DUPLICATE_LOCATIONS", 10))
 AICODER_FAISS_INDEX_FOLDER = os.environ.get("AICODER_FAISS_INDEX_FOLDER", "faiss")
-AICODER_FAISS_INDEX_FILE = os.path.join(AICODER_FAISS_INDEX_FOLDER, os.environ.get("AICODER_FAISS_INDEX_FILE", "faiss_index"))
-AICODER_FAISS_INDEX_CHUNKS_FILE = AICODER_FAISS_INDEX_FILE + "_chunks.pkl"
+AICODER_CHUNK_SIZE = int(os.environ.get("AICODER_CHUNK_SIZE", 500))
+# Index versions kept per shard by the index builder, the current one included
+AICODER_INDEX_KEEP_VERSIONS = int(os.environ.get("AICODER_INDEX_KEEP_VERSIONS", 3))
+AICODER_INDEX_VERIFY_CHECKSUMS = get_boolean_env_var("AICODER_INDEX_VERIFY_CHECKSUMS", True)
+# Build a missing index at server startup instead of refusing to start (indexes are normally built by index_builder.py)
+AICODER_INDEX_BUILD_ON_STARTUP = get_boolean_env_var("AICODER_INDEX_BUILD_ON_STARTUP", False)
+# Named index shards, one per repository: "core=/src/core,ran=/src/ran,tools=/src/tools".
+# When unset, a single DEFAULT_INDEX_SHARD indexes AICODER_5GCODE_PATH.
+AICODER_5GCODE_SHARDS = os.environ.get("AICODER_5GCODE_SHARDS", None)
+AICODER_SHARD_SEARCH_WORKERS = int(os.environ.get("AICODER_SHARD_SEARCH_WORKERS", 8))
+DEFAULT_INDEX_SHARD = "default"
+AICODER_MODEL_NAME = "5g-aicoder"
+HTTP_HEADER_AICODER_SHARDS = "x-aicoder-shards"
+# Hybrid retrieval: weight of the lexical (symbol/token) score vs. the dense FAISS score
+AICODER_HYBRID_LEXICAL_WEIGHT = float(os.environ.get("AICODER_HYBRID_LEXICAL_WEIGHT", 0.3))
+# Hybrid retrieval: candidates gathered from each retriever, as a multiple of k
+AICODER_HYBRID_CANDIDATES_FACTOR = int(os.environ.get("AICODER_HYBRID_CANDIDATES_FACTOR", 4))
+# Memory budget of the KV caches kept to continue conversations without prefilling their whole history again.
+# 0 sizes it from the LLM: AICODER_KV_CACHE_CONVERSATIONS conversations at the prompt and response token limits
+AICODER_KV_CACHE_MAX_BYTES = int(os.environ.get("AICODER_KV_CACHE_MAX_BYTES", 0))
+AICODER_KV_CACHE_CONVERSATIONS = int(os.environ.get("AICODER_KV_CACHE_CONVERSATIONS", 4))
+AICODER_MAX_PROMPT_TOKENS = int(os.environ.get("AICODER_MAX_PROMPT_TOKENS", 4096))
+AICODER_MAX_NEW_TOKENS = int(os.environ.get("AICODER_MAX_NEW_TOKENS", 2000))
+AICODER_GENERATION_CONCURRENCY = int(os.environ.get("AICODER_GENERATION_CONCURRENCY", 1))
+AICODER_EMBEDDING_BATCH_SIZE = int(os.environ.get("AICODER_EMBEDDING_BATCH_SIZE", 64))
+AICODER_EMBEDDING_MAX_INPUTS = int(os.environ.get("AICODER_EMBEDDING_MAX_INPUTS", 2048))
+AICODER_SEARCH_MAX_K = int(os.environ.get("AICODER_SEARCH_MAX_K", 50))
+AICODER_SEARCH_MAX_QUERIES = int(os.environ.get("AICODER_SEARCH_MAX_QUERIES", 256))
+AICODER_EMBEDDING_CACHE_TTL = int(os.environ.get("AICODER_EMBEDDING_CACHE_TTL", 7 * 24 * 3600))
 HTTP_HEADER_X_FORWARDED_FOR = "x-forwarded-for"
 
 LARGE_MAX_LRU_CACHE_SIZE = 2048
+AICODER_ACCESS_LOG_FILE = os.environ.get("AICODER_ACCESS_LOG_FILE", "access.log")
+# Debug (profiling) endpoints, disabled (404) unless a token is set
+AICODER_DEBUG_TOKEN = os.environ.get("AICODER_DEBUG_TOKEN", None)
+HTTP_HEADER_DEBUG_TOKEN = "x-debug-token"
+AICODER_PROFILE_MAX_SECONDS = int(os.environ.get("AICODER_PROFILE_MAX_SECONDS", 600))
+AICODER_PROFILE_MAX_REQUESTS = int(os.environ.get("AICODER_PROFILE_MAX_REQUESTS", 10000))
 TTL_EXPIRATION_IN_SECS = 3600
 
 AICODER_REDIS_SERVER = os.environ.get("AICODER_REDIS_SERVER", None)
@@ -0,0 +1,345 @@
+"""
+Copyright 2025 5G-AICoder. All Rights Reserved.
+Author: Marios Karagiannopoulos <mkaragiannop@juniper.net>
+Module IndexBuilder: Offline builder of versioned, validated index artifacts.
+
+Usage: python3 src/index_builder.py [--shard NAME ...]
+"""
+
+# pylint: disable=logging-fstring-interpolation,too-many-statements
+
+import os
+import sys
+import json
+import time
+import shutil
+import pickle
+import hashlib
+import logging
+import argparse
+import datetime as dt
+import faiss
+
+from symbol_index import SymbolIndex
+from chunk_dedup import ChunkDeduplicator, is_excluded
+from index_shard import configured_index_shards
+from constants import (
+    AICODER_LOGLEVEL,
+    AICODER_5GCODE_EXTENSIONS,
+    AICODER_5GCODE_EXCLUDE_GLOBS,
+    AICODER_NEAR_DUPLICATE_THRESHOLD,
+    AICODER_MAX_DUPLICATE_LOCATIONS,
+    AICODER_CHUNK_SIZE,
+    AICODER_EMBEDDING_BATCH_SIZE,
+    AICODER_INDEX_KEEP_VERSIONS,
+    AICODER_INDEX_VERIFY_CHECKSUMS,
+    LLMModels,
+)
+
+logger = logging.getLogger()
+
+INDEX_FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "faiss.index"
+CHUNKS_FILE = "chunks.pkl"
+METADATA_FILE = "metadata.pkl"
+SYMBOLS_FILE = "symbols.pkl"
+ARTIFACT_FILES = (INDEX_FILE, CHUNKS_FILE, METADATA_FILE, SYMBOLS_FILE)
+
+
+class IndexArtifactError(RuntimeError):
+    """An index artifact is missing, corrupted or was built for another embedding model."""
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IndexBuilder:
+    """
+    Builds the index of a shard into a new version folder: <shard folder>/versions/<version>/ holding the FAISS index,
+    the chunks, their locations, the symbol index and a manifest (embedding model and dimension, chunking parameters,
+    corpus hash, build stats and file checksums). The CURRENT file of the shard is switched to it only once complete.
+    """
+
+    def __init__(self, embedding_model, chunk_size=AICODER_CHUNK_SIZE):
+        self.__embedding_model = embedding_model
+        self.__chunk_size = chunk_size
+
+    # Step 1: Extract and chunk repository data
+    def _extract_and_chunk(self, repo_path):
+        """
+        Extract and chunk repository data into smaller pieces.
+        Returns the chunks, for each chunk where it comes from (file path relative to the
+        repository, character offsets and line numbers), the symbol/token index of the chunks, build statistics
+        and the hash of the indexed corpus (paths and contents, walked in sorted order).
+        Identical (and optionally near-identical) chunks are kept and embedded once, their other locations
+        are counted under "duplicate_count" and the first AICODER_MAX_DUPLICATE_LOCATIONS of them listed under
+        "duplicates", so that a license header repeated in every file does not bloat the metadata.
+        Files matching AICODER_5GCODE_EXCLUDE_GLOBS are skipped.
+        """
+        chunk_size = self.__chunk_size
+        chunks = []
+        metadata = []
+        symbol_index = SymbolIndex()
+        deduplicator = ChunkDeduplicator(AICODER_NEAR_DUPLICATE_THRESHOLD)
+        corpus_hash = hashlib.sha256()
+        stats = {
+            "files_indexed": 0,
+            "files_excluded": 0,
+            "chunks_total": 0,
+            "exact_duplicates": 0,
+            "near_duplicates": 0,
+            "bytes_total": 0,
+            "bytes_saved": 0,
+        }
+        allowed_extensions = tuple(AICODER_5GCODE_EXTENSIONS.split(","))
+        exclude_globs = [pattern.strip() for pattern in AICODER_5GCODE_EXCLUDE_GLOBS.split(",") if pattern.strip()]
+        for root, dirs, files in os.walk(repo_path):
+            # Do not descend into excluded (vendored, generated) folders at all, walk the rest in a stable order
+            dirs[:] = sorted(
+                folder
+                for folder in dirs
+                if not is_excluded(os.path.relpath(os.path.join(root, folder), repo_path) + "/", exclude_globs)
+            )
+            for file in sorted(files):
+                if file.endswith(allowed_extensions):
+                    file_path = os.path.join(root, file)
+                    relative_path = os.path.relpath(file_path, repo_path)
+                    if is_excluded(relative_path, exclude_globs):
+                        stats["files_excluded"] += 1
+                        continue
+                    with open(file_path, "r", encoding="utf-8") as f:
+                        content = f.read()
+                    corpus_hash.update(relative_path.encode("utf-8") + b"\0" + content.encode("utf-8") + b"\0")
+                    stats["files_indexed"] += 1
+                    file_chunk_ids = []
+                    start_line = 1
+                    for i in range(0, len(content), chunk_size):
+                        chunk = content[i : i + chunk_size]
+                        newlines = chunk.count("\n")
+                        location = {
+                            "path": relative_path,
+                            "start": i,
+                            "end": i + len(chunk),
+                            "start_line": start_line,
+                            # A trailing newline ends the last line of the chunk, the next one starts on the next line
+                            "end_line": start_line + newlines - chunk.endswith("\n"),
+                        }
+                        chunk_bytes = len(chunk.encode("utf-8"))
+                        chunk_id, duplicate = deduplicator.assign(chunk, len(chunks))
+                        if duplicate is None:
+                            chunks.append(chunk)
+                            metadata.append(location)
+                            symbol_index.add_chunk(chunk_id, chunk)
+                        else:
+                            if duplicate == "near":
+                                location["near_duplicate"] = True
+                            original = metadata[chunk_id]
+                            original["duplicate_count"] = original.get("duplicate_count", 0) + 1
+                            duplicates = original.setdefault("duplicates", [])
+                            if AICODER_MAX_DUPLICATE_LOCATIONS < 0 or len(duplicates) < AICODER_MAX_DUPLICATE_LOCATIONS:
+                                duplicates.append(location)
+                            stats[f"{duplicate}_duplicates"] += 1
+                            stats["bytes_saved"] += chunk_bytes
+                        file_chunk_ids.append(chunk_id)
+                        stats["chunks_total"] += 1
+                        stats["bytes_total"] += chunk_bytes
+                        start_line += newlines
+                    if file_chunk_ids:
+                        symbol_index.add_file(content, file_chunk_ids, chunk_size)
+        stats["vectors_indexed"] = len(chunks)
+        stats["vectors_saved"] = stats["chunks_total"] - len(chunks)
+        return chunks, metadata, symbol_index, stats, corpus_hash.hexdigest()
+
+    # Step 2: Index the repository data using FAISS
+    def _create_faiss_index(self, chunks):
+        """
+        Create a FAISS index for the repository chunks.
+        """
+        # Generate embeddings
+        embeddings = self.__embedding_model.encode(chunks, batch_size=AICODER_EMBEDDING_BATCH_SIZE, convert_to_numpy=True)
+
+        # Create the FAISS index
+        index = faiss.IndexFlatL2(embeddings.shape[1])  # L2 distance index
+        index.add(embeddings)
+        return index
+
+    def build(self, shard):
+        """
+        Build a new index version of the shard, make it the current one and prune the oldest versions.
+        Returns the manifest of the new version.
+        """
+        start_time = time.perf_counter()
+        logger.info(f"Shard '{shard.name}': extracting and chunking repository data from '{shard.repo_path}'...")
+        chunks, metadata, symbol_index, build_stats, corpus_hash = self._extract_and_chunk(shard.repo_path)
+        if not chunks:
+            raise IndexArtifactError(f"Shard '{shard.name}': no files to index under '{shard.repo_path}'")
+        logger.info(f"Shard '{shard.name}': total chunks extracted: {len(chunks)}, symbols: {symbol_index.num_symbols}")
+        index = self._create_faiss_index(chunks)
+        build_stats["vector_bytes_saved"] = build_stats["vectors_saved"] * index.d * 4
+        build_stats["build_seconds"] = round(time.perf_counter() - start_time, 3)
+
+        created_at = dt.datetime.now(dt.timezone.utc)
+        version = f"{created_at.strftime('%Y%m%dT%H%M%SZ')}-{corpus_hash[:12]}"
+        os.makedirs(shard.versions_folder, exist_ok=True)
+        # Two builds of the same corpus within the same second
+        suffix = 1
+        while os.path.exists(os.path.join(shard.versions_folder, version)):
+            version = f"{created_at.strftime('%Y%m%dT%H%M%SZ')}-{corpus_hash[:12]}-{suffix}"
+            suffix += 1
+        # Written under a temporary name and renamed, a crashed build never looks like a valid version
+        staging_folder = os.path.join(shard.versions_folder, f".{version}.tmp")
+        shutil.rmtree(staging_folder, ignore_errors=True)
+        os.makedirs(staging_folder)
+        faiss.write_index(index, os.path.join(staging_folder, INDEX_FILE))
+        for file_name, content in ((CHUNKS_FILE, chunks), (METADATA_FILE, metadata), (SYMBOLS_FILE, symbol_index)):
+            with open(os.path.join(staging_folder, file_name), "wb") as f:
+                pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+        manifest = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "version": version,
+            "shard": shard.name,
+            "repo_path": shard.repo_path,
+            "created_at": created_at.isoformat(),
+            "embedding_model": LLMModels.EMBEDDING_MODEL.value,
+            "embedding_dim": index.d,
+            "index_type": type(index).__name__,
+            "num_vectors": index.ntotal,
+            "chunking": {
+                "chunk_size": self.__chunk_size,
+                "extensions": AICODER_5GCODE_EXTENSIONS.split(","),
+                "exclude_globs": [pattern.strip() for pattern in AICODER_5GCODE_EXCLUDE_GLOBS.split(",") if pattern.strip()],
+                "near_duplicate_threshold": AICODER_NEAR_DUPLICATE_THRESHOLD,
+                "max_duplicate_locations": AICODER_MAX_DUPLICATE_LOCATIONS,
+            },
+            "corpus_hash": corpus_hash,
+            "build_stats": build_stats,
+            "files": {file_name: _sha256_file(os.path.join(staging_folder, file_name)) for file_name in ARTIFACT_FILES},
+        }
+        with open(os.path.join(staging_folder, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(staging_folder, os.path.join(shard.versions_folder, version))
+
+        current_tmp = shard.current_file + ".tmp"
+        with open(current_tmp, "w") as f:
+            f.write(version + "\n")
+        os.replace(current_tmp, shard.current_file)
+        self._prune_versions(shard, version)
+        logger.info(f"Shard '{shard.name}': index version '{version}' built. Build stats: {build_stats}")
+        return manifest
+
+    def _prune_versions(self, shard, current_version):
+        versions = sorted(name for name in os.listdir(shard.versions_folder) if not name.startswith("."))
+        for version in versions[: max(0, len(versions) - AICODER_INDEX_KEEP_VERSIONS)]:
+            if version != current_version:
+                logger.info(f"Shard '{shard.name}': removing old index version '{version}'")
+                shutil.rmtree(os.path.join(shard.versions_folder, version), ignore_errors=True)
+
+
+def check_embedding_dim(shard, manifest, embedding_dim):
+    """
+    Raise IndexArtifactError when an index version was built with another embedding dimension than embedding_dim.
+    """
+    if manifest.get("embedding_dim") != embedding_dim:
+        raise IndexArtifactError(
+            f"Shard '{shard.name}': index version '{manifest.get('version')}' has embedding dimension "
+            f"{manifest.get('embedding_dim')}, the embedding model produces {embedding_dim}"
+        )
+
+
+def load_index_artifact(shard, embedding_dim=None):
+    """
+    Load and verify the current index version of a shard.
+    Returns ((index, chunks, metadata, symbol_index), manifest), or None when the shard has no built version yet.
+    Raises IndexArtifactError when the artifact is incomplete, corrupted (checksums, sizes) or was built with
+    another embedding model, or another dimension than embedding_dim when given.
+    """
+    if not os.path.exists(shard.current_file):
+        return None
+    with open(shard.current_file, "r") as f:
+        version = f.read().strip()
+    folder = os.path.join(shard.versions_folder, version)
+    manifest_path = os.path.join(folder, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise IndexArtifactError(f"Shard '{shard.name}': manifest of current index version '{version}' not found")
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+
+    if manifest.get("format_version") != INDEX_FORMAT_VERSION:
+        raise IndexArtifactError(
+            f"Shard '{shard.name}': index format {manifest.get('format_version')} is not supported "
+            f"(expected {INDEX_FORMAT_VERSION}), rebuild it with index_builder.py"
+        )
+    if manifest.get("embedding_model") != LLMModels.EMBEDDING_MODEL.value:
+        raise IndexArtifactError(
+            f"Shard '{shard.name}': index version '{version}' was built with embedding model "
+            f"'{manifest.get('embedding_model')}', the server uses '{LLMModels.EMBEDDING_MODEL.value}'"
+        )
+    if embedding_dim is not None:
+        check_embedding_dim(shard, manifest, embedding_dim)
+    for file_name in ARTIFACT_FILES:
+        path = os.path.join(folder, file_name)
+        if not os.path.exists(path):
+            raise IndexArtifactError(f"Shard '{shard.name}': '{file_name}' missing from index version '{version}'")
+        if AICODER_INDEX_VERIFY_CHECKSUMS and _sha256_file(path) != manifest["files"].get(file_name):
+            raise IndexArtifactError(f"Shard '{shard.name}': checksum mismatch of '{file_name}' in index version '{version}'")
+
+    index = faiss.read_index(os.path.join(folder, INDEX_FILE))
+    with open(os.path.join(folder, CHUNKS_FILE), "rb") as f:
+        chunks = pickle.load(f)
+    with open(os.path.join(folder, METADATA_FILE), "rb") as f:
+        metadata = pickle.load(f)
+    with open(os.path.join(folder, SYMBOLS_FILE), "rb") as f:
+        symbol_index = pickle.load(f)
+    if index.d != manifest["embedding_dim"] or not index.ntotal == manifest["num_vectors"] == len(chunks) == len(metadata):
+        raise IndexArtifactError(f"Shard '{shard.name}': index version '{version}' is inconsistent with its manifest")
+    return (index, chunks, metadata, symbol_index), manifest
+
+
+if __name__ == "__main__":
+    logger.setLevel(AICODER_LOGLEVEL)
+    handler = logging.StreamHandler()
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(module)s:%(funcName)s:%(lineno)d - %(message)s")
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+    parser = argparse.ArgumentParser(description="Build the versioned index artifacts of the configured shards.")
+    parser.add_argument(
+        "--shard",
+        action="append",
+        default=[],
+        help="Shard to build, repeatable (default: every shard of AICODER_5GCODE_SHARDS, or 'default')",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=AICODER_CHUNK_SIZE,
+        help=f"Chunk size in characters (default: {AICODER_CHUNK_SIZE})",
+    )
+    args = parser.parse_args()
+
+    shards = {shard.name: shard for shard in configured_index_shards()}
+    unknown = [name for name in args.shard if name not in shards]
+    if unknown:
+        parser.error(f"unknown shard(s): {', '.join(unknown)}. Available: {', '.join(shards)}")
+
+    # Only the embedding model is needed to build, the LLM is never loaded
+    from sentence_transformers import SentenceTransformer
+
+    builder = IndexBuilder(SentenceTransformer(LLMModels.EMBEDDING_MODEL.value), chunk_size=args.chunk_size)
+    failed = False
+    for name in args.shard or shards:
+        try:
+            manifest = builder.build(shards[name])
+            # Read it back exactly as the server does at startup
+            load_index_artifact(shards[name], manifest["embedding_dim"])
+            print(json.dumps({key: manifest[key] for key in ("shard", "version", "num_vectors", "build_stats")}))
+        except Exception as e:
+            logger.error(f"Shard '{name}': index build failed: {e}")
+            failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,64 @@
+"""
+Copyright 2025 5G-AICoder. All Rights Reserved.
+Author: Marios Karagiannopoulos <mkaragiannop@juniper.net>
+Module IndexShard: A named FAISS index over one repository.
+"""
+
+# pylint: disable=logging-fstring-interpolation,too-many-statements
+
+import os
+import re
+import threading
+
+from constants import (
+    AICODER_5GCODE_PATH,
+    AICODER_5GCODE_SHARDS,
+    AICODER_FAISS_INDEX_FOLDER,
+    DEFAULT_INDEX_SHARD,
+)
+
+SHARD_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class IndexShard:
+    """
+    One named index (FAISS vectors, chunks, chunk locations, symbol index and build stats) over one repository.
+    Each shard is stored in its own folder and built or retrained independently of the others.
+    Built versions live under versions/<version>/, the CURRENT file names the one to serve.
+    """
+
+    def __init__(self, name, repo_path, index_folder):
+        self.name = name
+        self.repo_path = repo_path
+        self.index_folder = index_folder
+        self.versions_folder = os.path.join(index_folder, "versions")
+        self.current_file = os.path.join(index_folder, "CURRENT")
+        # (index, chunks, metadata, symbol_index), replaced as a whole so readers never mix two builds
+        self.data = None
+        self.manifest = {}
+        self.retrain_lock = threading.Lock()
+
+    def __repr__(self):
+        return f"IndexShard(name={self.name!r}, repo_path={self.repo_path!r}, index_folder={self.index_folder!r})"
+
+
+def configured_index_shards():
+    """
+    Parse AICODER_5GCODE_SHARDS ("core=/src/core,ran=/src/ran") into shards stored under AICODER_FAISS_INDEX_FOLDER/<name>.
+    Without it, a single "default" shard indexes AICODER_5GCODE_PATH directly under AICODER_FAISS_INDEX_FOLDER,
+    which keeps the layout of existing single repository deployments.
+    """
+    if not AICODER_5GCODE_SHARDS:
+        return [IndexShard(DEFAULT_INDEX_SHARD, AICODER_5GCODE_PATH, AICODER_FAISS_INDEX_FOLDER)]
+    shards = []
+    for entry in AICODER_5GCODE_SHARDS.split(","):
+        if not entry.strip():
+            continue
+        name, separator, repo_path = entry.partition("=")
+        name = name.strip()
+        if not separator or not SHARD_NAME_PATTERN.match(name) or not repo_path.strip():
+            raise ValueError(f"Invalid AICODER_5GCODE_SHARDS entry '{entry}', expected <name>=<repository path>")
+        if any(shard.name == name for shard in shards):
+            raise ValueError(f"Duplicate index shard name '{name}' in AICODER_5GCODE_SHARDS")
+        shards.append(IndexShard(name, repo_path.strip(), os.path.join(AICODER_FAISS_INDEX_FOLDER, name)))
+    return shards
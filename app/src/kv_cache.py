@@ -0,0 +1,129 @@
+"""
+Copyright 2025 5G-AICoder. All Rights Reserved.
+Author: Marios Karagiannopoulos <mkaragiannop@juniper.net>
+Module PrefixKVCache: LRU of the LLM KV caches of ongoing conversations.
+"""
+
+# pylint: disable=logging-fstring-interpolation,too-many-statements
+
+import hashlib
+import logging
+import threading
+import orjson
+
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+
+def conversation_key(messages):
+    """
+    Hash of a conversation (role and content of every message), whitespace around contents ignored.
+    """
+    normalized = [[message["role"], message["content"].strip()] for message in messages]
+    return hashlib.sha256(orjson.dumps(normalized)).hexdigest()
+
+
+def kv_cache_nbytes(past_key_values):
+    """
+    Memory held by the key/value tensors of a transformers cache.
+    """
+    if hasattr(past_key_values, "layers"):  # transformers >= 4.56
+        tensors = [tensor for layer in past_key_values.layers for tensor in (layer.keys, layer.values)]
+    elif hasattr(past_key_values, "key_cache"):
+        tensors = list(past_key_values.key_cache) + list(past_key_values.value_cache)
+    else:  # legacy tuple of (key, value) per layer
+        tensors = [tensor for layer in past_key_values for tensor in layer]
+    return sum(tensor.nelement() * tensor.element_size() for tensor in tensors if tensor is not None)
+
+
+def kv_cache_bytes_per_token(config, element_size):
+    """
+    KV cache memory per token of a decoder LLM: one key and one value vector per layer and key/value head.
+    """
+    num_heads = config.num_attention_heads
+    num_kv_heads = getattr(config, "num_key_value_heads", None) or num_heads
+    head_dim = getattr(config, "head_dim", None) or config.hidden_size // num_heads
+    return config.num_hidden_layers * 2 * num_kv_heads * head_dim * element_size
+
+
+class ConversationState:
+    """
+    What a conversation turn leaves behind for the next one: the messages exactly as rendered for the LLM
+    (retrieved context included), the token ids covered by the KV cache and the KV cache itself.
+    """
+
+    __slots__ = ("messages", "token_ids", "past_key_values", "nbytes")
+
+    def __init__(self, messages, token_ids, past_key_values):
+        self.messages = messages
+        self.token_ids = token_ids
+        self.past_key_values = past_key_values
+        self.nbytes = kv_cache_nbytes(past_key_values)
+
+
+class PrefixKVCache:
+    """
+    Bounded LRU of conversation states, keyed by the conversation_key of the conversation they continue.
+    Eviction is by the memory size of the KV caches. Entries are taken (removed) on lookup, since generation
+    extends the KV cache in place; the next turn stores its own state.
+    """
+
+    def __init__(self, max_bytes):
+        self.__max_bytes = max_bytes
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def resize(self, max_bytes):
+        """
+        Change the memory budget, evicting the least recently used entries beyond it.
+        """
+        with self.__lock:
+            self.__max_bytes = max_bytes
+            self.__evict()
+
+    def __evict(self):
+        while self.__bytes > self.__max_bytes:
+            _, evicted = self.__entries.popitem(last=False)
+            self.__bytes -= evicted.nbytes
+            self.__evictions += 1
+
+    def take(self, key):
+        with self.__lock:
+            state = self.__entries.pop(key, None)
+            if state is None:
+                self.__misses += 1
+                return None
+            self.__hits += 1
+            self.__bytes -= state.nbytes
+            return state
+
+    def put(self, key, state):
+        if state.nbytes > self.__max_bytes:
+            logger.info(
+                f"KV cache of {len(state.token_ids)} tokens ({state.nbytes} bytes) exceeds the cache size "
+                f"({self.__max_bytes} bytes, AICODER_KV_CACHE_MAX_BYTES), not kept"
+            )
+            return
+        with self.__lock:
+            previous = self.__entries.pop(key, None)
+            if previous is not None:
+                self.__bytes -= previous.nbytes
+            self.__entries[key] = state
+            self.__bytes += state.nbytes
+            self.__evict()
+
+    def stats(self):
+        with self.__lock:
+            return {
+                "entries": len(self.__entries),
+                "bytes": self.__bytes,
+                "max_bytes": self.__max_bytes,
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "evictions": self.__evictions,
+            }
@@ -0,0 +1,222 @@
+"""
+Copyright 2025 5G-AICoder. All Rights Reserved.
+Author: Marios Karagiannopoulos <mkaragiannop@juniper.net>
+Module Profiler: On-demand profiling of the RAG pipeline (sampling, cProfile and torch profiler traces).
+"""
+
+# pylint: disable=logging-fstring-interpolation,too-many-statements
+
+import contextlib
+import cProfile
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+import torch
+
+from collections import Counter
+from torch.profiler import ProfilerActivity, profile, record_function
+
+logger = logging.getLogger()
+
+PROFILE_MODES = ("sample", "cprofile")
+
+
+class ProfilingBusyError(RuntimeError):
+    """A profiling session or torch trace is already running."""
+
+
+_torch_trace = threading.local()
+_torch_trace_lock = threading.Lock()
+
+
+def trace_region(name):
+    """
+    Label a region of the pipeline ("embed", "generate"...) in torch profiler traces, a no-op outside of them.
+    """
+    if getattr(_torch_trace, "active", False):
+        return record_function(name)
+    return contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def torch_trace(trace_file):
+    """
+    Run the block under the torch profiler (CPU, and CUDA when available) with its trace_region labels,
+    then write the trace in the Chrome trace format (chrome://tracing, ui.perfetto.dev).
+    """
+    if not _torch_trace_lock.acquire(blocking=False):
+        raise ProfilingBusyError("A torch profiler trace is already running")
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    _torch_trace.active = True
+    try:
+        with profile(activities=activities, record_shapes=True) as profiler:
+            yield
+        profiler.export_chrome_trace(trace_file)
+    finally:
+        _torch_trace.active = False
+        _torch_trace_lock.release()
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfilingSession:
+    """
+    One profiling session, bounded by a number of requests, a time window, or both (whichever comes first).
+    - sample: a background thread samples the Python stacks of the threads serving the pipeline (or all
+      threads) every interval and aggregates them as collapsed stacks, for flamegraph.pl or speedscope.
+    - cprofile: each pipeline call runs under cProfile and the statistics are merged, as a pstats file.
+      Calls are profiled one at a time, concurrent ones run unprofiled and are not counted.
+    """
+
+    def __init__(self, mode, requests=None, seconds=None, interval=0.005, all_threads=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.mode = mode
+        self.max_requests = requests
+        self.seconds = seconds
+        self.interval = interval
+        self.all_threads = all_threads
+        self.requests = 0
+        self.samples = 0
+        self.started = time.time()
+        self.finished = None
+        self.__deadline = time.monotonic() + seconds if seconds else None
+        self.__lock = threading.Lock()
+        self.__done = threading.Event()
+        self.__active_threads = set()
+        self.__stacks = Counter()
+        self.__cprofile_slot = threading.Lock()
+        self.__stats = None
+        self.__thread = threading.Thread(target=self.__watch, name=f"profiler-{self.id}", daemon=True)
+        self.__thread.start()
+
+    @property
+    def done(self):
+        return self.__done.is_set()
+
+    def finish(self):
+        with self.__lock:
+            if self.__done.is_set():
+                return
+            self.finished = time.time()
+            self.__done.set()
+        logger.info(f"Profiling session {self.id} finished: {self.status()}")
+
+    def __watch(self):
+        own_thread = threading.get_ident()
+        while not self.__done.wait(self.interval if self.mode == "sample" else 0.1):
+            if self.__deadline is not None and time.monotonic() >= self.__deadline:
+                self.finish()
+            elif self.mode == "sample":
+                self.__sample(own_thread)
+
+    def __sample(self, own_thread):
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        with self.__lock:
+            active_threads = set(self.__active_threads)
+        for thread_id, frame in sys._current_frames().items():  # pylint: disable=protected-access
+            if thread_id == own_thread or not (self.all_threads or thread_id in active_threads):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if self.all_threads:
+                # Pipeline calls run in interchangeable worker threads, only name them when sampling everything
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+            self.__stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def run(self, func, *args, **kwargs):
+        """
+        Run one pipeline call as part of this session.
+        """
+        thread_id = threading.get_ident()
+        counted = True
+        with self.__lock:
+            self.__active_threads.add(thread_id)
+        try:
+            if self.mode == "cprofile":
+                counted = self.__cprofile_slot.acquire(blocking=False)
+                if counted:
+                    profiler = cProfile.Profile()
+                    try:
+                        return profiler.runcall(func, *args, **kwargs)
+                    finally:
+                        self.__cprofile_slot.release()
+                        with self.__lock:
+                            if self.__stats is None:
+                                self.__stats = pstats.Stats(profiler)
+                            else:
+                                self.__stats.add(profiler)
+            return func(*args, **kwargs)
+        finally:
+            with self.__lock:
+                self.__active_threads.discard(thread_id)
+                if counted:
+                    self.requests += 1
+                limit_reached = self.max_requests is not None and self.requests >= self.max_requests
+            if limit_reached:
+                self.finish()
+
+    def status(self):
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "state": "finished" if self.done else "running",
+            "requests": self.requests,
+            "max_requests": self.max_requests,
+            "seconds": self.seconds,
+            "samples": self.samples if self.mode == "sample" else None,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+    def result(self):
+        """
+        Collapsed stacks (text, "frame;frame;frame count" per line) or the marshalled pstats of a finished session.
+        """
+        with self.__lock:
+            if self.mode == "sample":
+                return "".join(f"{stack} {count}\n" for stack, count in self.__stacks.most_common()).encode()
+            return marshal.dumps(self.__stats.stats if self.__stats is not None else {})
+
+
+class Profiler:
+    """
+    Entry point of the pipeline calls (chat, search, embeddings) into profiling. Holds at most one session;
+    without a running session, run() calls straight through, so profiling costs nothing until it is requested.
+    """
+
+    def __init__(self):
+        self.__session = None
+        self.__lock = threading.Lock()
+
+    def start(self, mode, requests=None, seconds=None, interval=0.005, all_threads=False):
+        """
+        Start a session, raises ProfilingBusyError while another one is running.
+        """
+        with self.__lock:
+            if self.__session is not None and not self.__session.done:
+                raise ProfilingBusyError(f"Profiling session {self.__session.id} is already running")
+            self.__session = ProfilingSession(mode, requests, seconds, interval, all_threads)
+            logger.warning(f"Profiling session started: {self.__session.status()}")
+            return self.__session
+
+    @property
+    def session(self):
+        return self.__session
+
+    def run(self, func, *args, **kwargs):
+        session = self.__session
+        if session is None or session.done:
+            return func(*args, **kwargs)
+        return session.run(func, *args, **kwargs)
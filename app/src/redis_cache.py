@@ -105,6 +105,28 @@ class RedisCache:
             return orjson.loads(retrieved_data)
         return retrieved_data if retrieved_data else None
 
+    async def get_redis_keys(self, cache_keys: list) -> list:
+        """Fetch several raw values in one round trip, returning None for misses."""
+        if self._redis_client is None or not cache_keys:
+            return [None] * len(cache_keys)
+        try:
+            return await self._redis_client.mget(cache_keys)
+        except Exception as ex:
+            logger.error(f"Error retrieving redis keys: {ex}")
+            return [None] * len(cache_keys)
+
+    async def store_redis_keys(self, mapping: dict, ex=TTL_EXPIRATION_IN_SECS) -> None:
+        """Store several raw values in one pipelined round trip."""
+        if self._redis_client is None or not mapping:
+            return
+        try:
+            async with self._redis_client.pipeline(transaction=False) as pipe:
+                for cache_key, cache_value in mapping.items():
+                    pipe.set(cache_key, cache_value, ex=ex)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error storing redis keys: {e}")
+
     # @_check_client_initialized
     async def get_all_redis_keys(self) -> dict:
         keys = await self._redis_client.keys("*")
@@ -115,7 +137,9 @@ class RedisCache:
             if not isinstance(value, bytes):
                 continue
             key = key.decode("utf-8")
-            json_content[f"{key}"] = {"value": f"{value.decode('utf-8')[:16] if value else None}", "ttl": ttl}
+            # Values may be binary (e.g. cached embeddings), so only decode the preview
+            preview = value[:16].decode("utf-8", errors="replace") if value else None
+            json_content[f"{key}"] = {"value": f"{preview}", "ttl": ttl}
         json_content["total"] = len(keys)
         return json_content
 
@@ -0,0 +1,213 @@
+"""
+Copyright 2025 5G-AICoder. All Rights Reserved.
+Author: Marios Karagiannopoulos <mkaragiannop@juniper.net>
+Module SymbolIndex: Inverted index of code symbols and tokens.
+"""
+
+# pylint: disable=logging-fstring-interpolation,too-many-statements
+
+import re
+import math
+
+# Definitions of functions, classes, structs, macros and types (Python, C/C++, Go)
+SYMBOL_DEFINITION_PATTERNS = [
+    re.compile(r"^[ \t]*(?:async[ \t]+)?def[ \t]+([A-Za-z_]\w*)", re.MULTILINE),
+    re.compile(r"^[ \t]*class[ \t]+([A-Za-z_]\w*)", re.MULTILINE),
+    re.compile(r"^[ \t]*#[ \t]*define[ \t]+([A-Za-z_]\w*)", re.MULTILINE),
+    re.compile(r"\b(?:struct|union|enum)[ \t]+([A-Za-z_]\w*)\s*\{"),
+    re.compile(r"^\}[ \t]*([A-Za-z_]\w*)[ \t]*;", re.MULTILINE),  # typedef struct {...} name;
+    re.compile(r"^[ \t]*typedef[^;{]*?\b([A-Za-z_]\w*)[ \t]*;", re.MULTILINE),
+    re.compile(r"^func[ \t]+(?:\([^)]*\)[ \t]*)?([A-Za-z_]\w*)", re.MULTILINE),
+    re.compile(r"^[ \t]*type[ \t]+([A-Za-z_]\w*)[ \t]+(?:struct|interface)\b", re.MULTILINE),
+    # C/C++ function definitions: return type(s) at column 0, the name on the same line or the next one,
+    # single-level parameter list, opening brace on the same line or below
+    re.compile(
+        r"^(?:[A-Za-z_][\w:<>]*[ \t\*&]+)*[A-Za-z_][\w:<>]*(?:[ \t\*&]+|[ \t\*&]*\n[ \t\*&]*)"
+        r"([A-Za-z_][\w:]*)[ \t]*\([^;{()]*\)\s*(?:const\s*)?\{",
+        re.MULTILINE,
+    ),
+]
+C_KEYWORDS = frozenset(["if", "for", "while", "switch", "return", "sizeof", "else", "do", "case"])
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+CAMEL_CASE_PATTERN = re.compile(r"[a-z][A-Z]")
+SUBTOKEN_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+QUERY_STOPWORDS = frozenset(
+    "a an and are as at be by does do for from how in is it of on or the this that to what where which who why with "
+    "function functions method class struct macro implement implements implemented defined define code file".split()
+)
+MIN_TOKEN_LENGTH = 3
+
+
+def split_identifier(identifier):
+    """
+    Split an identifier into lowercase sub-tokens (snake_case and camelCase aware).
+    """
+    return [token.lower() for token in SUBTOKEN_PATTERN.findall(identifier) if len(token) >= MIN_TOKEN_LENGTH]
+
+
+def symbol_definitions(content):
+    """
+    Yield the name and offset of each symbol defined in a file, C functions in the usual layouts included:
+
+    >>> sources = [
+    ...     "int nsst_create(struct ctx *c)\\n{\\n    return 0;\\n}\\n",
+    ...     "static int\\nnsst_create(void)\\n{\\n    return 0;\\n}\\n",
+    ...     "ogs_pfcp_node_t *ogs_pfcp_node_new(ogs_sockaddr_t *sa_list)\\n{\\n    return NULL;\\n}\\n",
+    ... ]
+    >>> [[name for name, _ in symbol_definitions(source)] for source in sources]
+    [['nsst_create'], ['nsst_create'], ['ogs_pfcp_node_new']]
+    >>> [name for name, _ in symbol_definitions("int main(void)\\n{\\n    if (ready)\\n    {\\n    }\\n}\\n")]
+    ['main']
+    """
+    for pattern in SYMBOL_DEFINITION_PATTERNS:
+        for match in pattern.finditer(content):
+            if match.group(1) not in C_KEYWORDS:
+                yield match.group(1), match.start(1)
+
+
+def looks_like_identifier(word):
+    """
+    True for words that are unlikely to be plain English: snake_case, camelCase, digits or ALL CAPS.
+    """
+    return "_" in word or any(c.isdigit() for c in word) or any(c.isupper() for c in word[1:])
+
+
+def is_code_identifier(word):
+    """
+    True for snake_case and camelCase words, which name code rather than a concept.
+    ALL CAPS words are not: 5G acronyms (UPF, AMF, PDU) are both macro names and plain words in questions.
+    """
+    return "_" in word.strip("_") or CAMEL_CASE_PATTERN.search(word) is not None
+
+
+class SymbolIndex:
+    """
+    Maps symbol names to the chunks defining them, and tokens to the chunks mentioning them.
+    """
+
+    def __init__(self):
+        self.__symbols = {}  # symbol name -> chunk ids holding its definition
+        self.__postings = {}  # token -> chunk ids containing it
+        self.__num_chunks = 0
+        self.__symbols_lower = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_SymbolIndex__symbols_lower"] = None  # derived, rebuilt lazily after unpickling
+        return state
+
+    @property
+    def num_symbols(self):
+        return len(self.__symbols)
+
+    def add_file(self, content, chunk_ids, chunk_size):
+        """
+        Register the symbols defined in a file. chunk_ids[n] is the chunk holding content[n * chunk_size:].
+        Symbols are extracted from the whole file, so definitions spanning a chunk boundary are not lost.
+        """
+        for name, offset in symbol_definitions(content):
+            chunk_id = chunk_ids[min(offset // chunk_size, len(chunk_ids) - 1)]
+            definitions = self.__symbols.setdefault(name, [])
+            if chunk_id not in definitions:
+                definitions.append(chunk_id)
+        self.__symbols_lower = None
+
+    def add_chunk(self, chunk_id, text):
+        """
+        Register the tokens (whole identifiers and their sub-tokens) mentioned in a chunk.
+        """
+        tokens = set()
+        for identifier in IDENTIFIER_PATTERN.findall(text):
+            if len(identifier) >= MIN_TOKEN_LENGTH:
+                tokens.add(identifier.lower())
+                tokens.update(split_identifier(identifier))
+        for token in tokens:
+            self.__postings.setdefault(token, []).append(chunk_id)
+        self.__num_chunks = max(self.__num_chunks, chunk_id + 1)
+
+    def __symbols_by_lowercase_name(self):
+        if self.__symbols_lower is None:
+            self.__symbols_lower = {}
+            for name in self.__symbols:
+                self.__symbols_lower.setdefault(name.lower(), []).append(name)
+        return self.__symbols_lower
+
+    def __definitions(self, names, limit):
+        chunk_ids = []
+        for name in names:
+            for chunk_id in self.__symbols[name]:
+                if chunk_id not in chunk_ids:
+                    chunk_ids.append(chunk_id)
+        return chunk_ids[:limit]
+
+    def lookup_symbols(self, query, limit):
+        """
+        Return the chunks defining the symbols the query names unambiguously (exact symbol hits), at most limit:
+        backticked words (exactly, else case-insensitively) and snake_case or camelCase words spelled exactly
+        like a symbol.
+        """
+        quoted = set(re.findall(r"`([A-Za-z_][\w:]*)`", query))
+        names = []
+        for word in IDENTIFIER_PATTERN.findall(query):
+            if word in quoted:
+                names.extend([word] if word in self.__symbols else self.__symbols_by_lowercase_name().get(word.lower(), []))
+            elif is_code_identifier(word) and word in self.__symbols:
+                names.append(word)
+        return self.__definitions(names, limit)
+
+    def symbol_candidates(self, query, limit):
+        """
+        Return the chunks defining symbols the query may name, at most limit: identifier-looking words,
+        ALL CAPS included, matched case-insensitively. These are ranked along with the dense results,
+        not returned instead of them.
+        """
+        names = []
+        for word in IDENTIFIER_PATTERN.findall(query):
+            if looks_like_identifier(word):
+                names.extend(self.__symbols_by_lowercase_name().get(word.lower(), []))
+        return self.__definitions(names, limit)
+
+    def lexical_scores(self, query, limit):
+        """
+        Score chunks by the IDF-weighted fraction of query terms they mention, in [0, 1].
+        Returns the best limit chunks as a {chunk_id: score} dict.
+        """
+        terms = set()
+        for word in IDENTIFIER_PATTERN.findall(query):
+            if word.lower() in QUERY_STOPWORDS or len(word) < MIN_TOKEN_LENGTH:
+                continue
+            terms.add(word.lower())
+            terms.update(split_identifier(word))
+        weights = {}
+        for term in terms:
+            postings = self.__postings.get(term)
+            if postings:
+                weights[term] = math.log(1 + self.__num_chunks / len(postings))
+        total_weight = sum(weights.values())
+        if not total_weight:
+            return {}
+        scores = {}
+        for term, weight in weights.items():
+            for chunk_id in self.__postings[term]:
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + weight / total_weight
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return dict(best)
+
+
+def hybrid_rank(candidates, k, lexical_weight):
+    """
+    Fuse dense and lexical retrieval. candidates maps chunk id -> (L2 distance, lexical score).
+    Distances are min-max normalized into a similarity over the candidate set before weighting,
+    so the two signals share the same [0, 1] scale. Returns the top k (chunk_id, distance, score).
+    """
+    if not candidates:
+        return []
+    distances = [distance for distance, _ in candidates.values()]
+    min_distance, max_distance = min(distances), max(distances)
+    spread = (max_distance - min_distance) or 1.0
+    ranked = []
+    for chunk_id, (distance, lexical_score) in candidates.items():
+        dense_score = (max_distance - distance) / spread if max_distance > min_distance else 1.0
+        ranked.append((chunk_id, distance, (1 - lexical_weight) * dense_score + lexical_weight * lexical_score))
+    ranked.sort(key=lambda item: item[2], reverse=True)
+    return ranked[:k]
@@ -5,7 +5,7 @@ Module: WebServices API Models
 """
 
 # pylint: disable=logging-fstring-interpolation,too-many-statements
-from typing import List, Optional
+from typing import List, Literal, Optional, Union
 from pydantic import BaseModel
 
 
@@ -45,3 +45,62 @@ class ModelData(BaseModel):
 class ModelListResponse(BaseModel):
     object: str = "list"
     data: list[ModelData]
+
+
+# OpenAI-compatible embeddings request format
+class EmbeddingRequest(BaseModel):
+    model: str
+    input: Union[str, List[str]]
+    encoding_format: Optional[Literal["float", "base64"]] = "float"
+    user: Optional[str] = None
+
+
+class EmbeddingData(BaseModel):
+    object: str = "embedding"
+    index: int
+    embedding: Union[List[float], str]
+
+
+class EmbeddingResponse(BaseModel):
+    object: str = "list"
+    data: List[EmbeddingData]
+    model: str
+    usage: dict
+
+
+# Retrieval only search request format
+class SearchRequest(BaseModel):
+    query: Union[str, List[str]]
+    k: int = 5
+    model: Optional[str] = None  # "5g-aicoder:core+ran" scopes the search to these index shards
+
+
+class ChunkLocation(BaseModel):
+    path: str
+    start: int
+    end: int
+    start_line: int
+    end_line: int
+    near_duplicate: bool = False
+
+
+class SearchHit(ChunkLocation):
+    shard: str
+    text: str
+    distance: Optional[float] = None  # None for exact symbol hits, which skip the FAISS search
+    score: float
+    match: Literal["symbol", "hybrid", "dense", "lexical"]
+    duplicate_count: int = 0  # other locations with the same (or near-identical) content
+    duplicates: List[ChunkLocation] = []  # the first of them, up to AICODER_MAX_DUPLICATE_LOCATIONS
+
+
+class SearchResult(BaseModel):
+    index: int
+    query: str
+    hits: List[SearchHit]
+
+
+class SearchResponse(BaseModel):
+    object: str = "list"
+    data: List[SearchResult]
+    took_ms: float
@@ -9,17 +9,23 @@ Module: WebServices API Functions
 import configparser
 import logging
 import os
-import datetime as dt
 import asyncio
 import uvloop
 import web_models
 import uuid
 import time
+import base64
+import hashlib
+import struct
+import re
+import secrets
+import tempfile
+import numpy as np
 
 from openai import OpenAI
 from contextlib import asynccontextmanager
 from math import ceil
-from typing import List
+from typing import List, Optional
 from cachetools import TTLCache
 
 from hypercorn.asyncio import serve
@@ -27,8 +33,7 @@ from hypercorn.config import Config
 
 from fastapi import Depends, FastAPI, HTTPException, Request, Response, status
 from fastapi.middleware.gzip import GZipMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi_limiter import FastAPILimiter
 from fastapi_limiter.depends import RateLimiter
 from fastapi.security import APIKeyHeader
@@ -36,56 +41,123 @@ from fastapi import Security
 
 from utils import Utils
 from aicoder import AICoder
+from access_log import AccessLogMiddleware, RouteStats, start_access_logger
+from profiling import PROFILE_MODES, Profiler, ProfilingBusyError
 from redis_cache import RedisCache
-from constants import LARGE_MAX_LRU_CACHE_SIZE, TTL_EXPIRATION_IN_SECS, OPENAI_API_KEY
+from constants import (
+    LARGE_MAX_LRU_CACHE_SIZE,
+    AICODER_ACCESS_LOG_FILE,
+    AICODER_DEBUG_TOKEN,
+    AICODER_PROFILE_MAX_SECONDS,
+    AICODER_PROFILE_MAX_REQUESTS,
+    HTTP_HEADER_DEBUG_TOKEN,
+    TTL_EXPIRATION_IN_SECS,
+    OPENAI_API_KEY,
+    AICODER_EMBEDDING_MAX_INPUTS,
+    AICODER_EMBEDDING_CACHE_TTL,
+    AICODER_SEARCH_MAX_K,
+    AICODER_SEARCH_MAX_QUERIES,
+    AICODER_MODEL_NAME,
+    HTTP_HEADER_AICODER_SHARDS,
+    LLMModels,
+)
 
 logger = logging.getLogger()
 client = OpenAI()
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 
-# Custom middleware to add Cache-Control header to all responses
-class CacheControlMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        response = await call_next(request)
-        # if "force_retrieve=true" in request.url.query:
-        #     return response
-        # if not any(
-        #     x in request.url.path
-        #     for x in ["/redis/"]
-        # ):
-        #     response.headers["Cache-Control"] = f"public, max-age={find_seconds_until_next_hour()}"
-        logger.debug(f"response headers: {response.headers}")
-        return response
-
-
 class WebServices:
     """WebServices HTTP API Functions"""
 
     api_key_header = APIKeyHeader(name="Authorization", auto_error=True)
+    debug_token_header = APIKeyHeader(name=HTTP_HEADER_DEBUG_TOKEN, auto_error=False)
 
-    def __init__(self, http_port: int, redis_cache: RedisCache):
+    def __init__(self, http_port: int, redis_cache: RedisCache, aicoder: Optional[AICoder] = None):
         self.__http_port = http_port
         self.__redis_cache = redis_cache
-        self.__aicoder = AICoder()
-        # Configure access logger for logging requests
-        self.__access_logger = logging.getLogger("access")
-        self.__access_logger.setLevel(logging.INFO)
-        # Create a file handler for access logs
-        access_file_handler = logging.FileHandler("access.log")
-        access_file_handler.setLevel(logging.INFO)
-        # Create a formatter and set it for the access file handler
-        access_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-        access_file_handler.setFormatter(access_formatter)
-        # Add the file handler to the access logger
-        self.__access_logger.addHandler(access_file_handler)
+        self.__aicoder = aicoder if aicoder is not None else AICoder()
+        # Access log entries are JSON lines written by a background thread, never on the event loop
+        self.__access_logger, self.__access_log_listener = start_access_logger(AICODER_ACCESS_LOG_FILE)
+        self.__route_stats = RouteStats()
+        # Pipeline calls go through the profiler, a plain call unless a /debug/profile session runs
+        self.__profiler = Profiler()
         logger.info(f"HTTP_PORT={self.__http_port}")
 
+    def __requested_shards(self, model: Optional[str], request: Request, names: Optional[str] = None):
+        """
+        Index shards a request is scoped to: the explicit names, else the X-AICoder-Shards header ("core,ran"),
+        else the model suffix ("5g-aicoder:core+ran"). None means all shards.
+        """
+        if names is None:
+            names = request.headers.get(HTTP_HEADER_AICODER_SHARDS, "")
+            if not names and model and ":" in model:
+                names = model.split(":", 1)[1]
+        shard_names = [name.strip() for name in re.split(r"[,+]", names) if name.strip()]
+        try:
+            self.__aicoder.select_shards(shard_names)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return shard_names or None
+
+    def __require_components(self, *components):
+        """
+        Answer 503 (with Retry-After) while the AICoder components an endpoint needs are still loading.
+        """
+        if not self.__aicoder.components_ready(*components):
+            startup = self.__aicoder.startup_status()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"AICoder is not ready (startup {startup['status']}), retry later",
+                headers={"Retry-After": "10"},
+            )
+
+    async def __embed_with_cache(self, texts):
+        """
+        Embed texts, serving repeated content from REDIS.
+        Cache entries are keyed by the content hash and hold the token count followed by the raw float32 vector.
+        """
+        keys = [
+            f"embedding:{LLMModels.EMBEDDING_MODEL.value}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}" for text in texts
+        ]
+        cached = await self.__redis_cache.get_redis_keys(keys)
+        vectors = [None] * len(texts)
+        token_counts = [0] * len(texts)
+        misses = {}
+        for i, value in enumerate(cached):
+            if value:
+                token_counts[i] = struct.unpack_from("<I", value)[0]
+                vectors[i] = np.frombuffer(value, dtype=np.float32, offset=4)
+            else:
+                # Identical inputs within the same request are only encoded once
+                misses.setdefault(keys[i], []).append(i)
+        logger.debug(f"Embeddings requested: {len(texts)}, cache misses: {len(misses)}")
+        if misses:
+            miss_texts = [texts[positions[0]] for positions in misses.values()]
+            # Encoding is CPU/GPU bound, keep it off the event loop
+            embeddings, miss_token_counts = await asyncio.to_thread(
+                self.__profiler.run, self.__aicoder.embed_texts, miss_texts
+            )
+            to_store = {}
+            for (key, positions), embedding, token_count in zip(misses.items(), embeddings, miss_token_counts):
+                for i in positions:
+                    vectors[i] = embedding
+                    token_counts[i] = token_count
+                to_store[key] = struct.pack("<I", token_count) + embedding.tobytes()
+            await self.__redis_cache.store_redis_keys(to_store, ex=AICODER_EMBEDDING_CACHE_TTL)
+        return vectors, sum(token_counts)
+
     def configure_webapp_routes(self):
         """
-        Configures routes for the webapp.
+        Configures routes for the webapp and serves it until shutdown.
+        """
+        self.serve(self.build_app())
+
+    def build_app(self) -> FastAPI:
+        """
+        Builds the webapp with all its routes and middleware, without serving it.
         Returns:
-            Response: HTTP response.
+            FastAPI: the ASGI application.
         """
 
         # In-memory request count dictionary
@@ -137,6 +209,8 @@ class WebServices:
         # Lifespan event handler for setup and teardown
         @asynccontextmanager
         async def lifespan(_: FastAPI):
+            # Load the models and indexes in the background, Hypercorn binds and serves the health checks meanwhile
+            self.__aicoder.start()
             await FastAPILimiter.init(
                 redis=await self.__redis_cache.connect_to_redis(),
                 identifier=service_name_identifier,
@@ -144,6 +218,8 @@ class WebServices:
             )
             yield
             await FastAPILimiter.close()
+            # Flush the pending access log entries
+            self.__access_log_listener.stop()
 
         app = FastAPI(
             lifespan=lifespan,
@@ -153,8 +229,13 @@ class WebServices:
         )
         # Add Gzip middleware
         app.add_middleware(GZipMiddleware, minimum_size=1024)
-        # Add middleware globally
-        app.add_middleware(CacheControlMiddleware)
+        # Access log, per client IP counts and per route timing, outermost so that the timing covers compression
+        app.add_middleware(
+            AccessLogMiddleware,
+            access_logger=self.__access_logger,
+            route_stats=self.__route_stats,
+            request_counts=request_counts,
+        )
 
         def verify_api_key(api_key: str = Security(self.api_key_header)):
             if api_key != f"Bearer {OPENAI_API_KEY}":
@@ -164,9 +245,16 @@ class WebServices:
         @app.get("/v1/models", response_model=web_models.ModelListResponse)
         async def list_models():
             models = [
-                {"id": "5g-aicoder", "created": int(time.time()), "owned_by": "QA team"},
+                {"id": AICODER_MODEL_NAME, "created": int(time.time()), "owned_by": "QA team"},
                 {"id": "text-embedding-ada-002", "created": int(time.time()), "owned_by": "QA team"},
             ]
+            shard_names = self.__aicoder.shard_names
+            if len(shard_names) > 1:
+                # One model per index shard, to scope chat completions and searches to that repository
+                models.extend(
+                    {"id": f"{AICODER_MODEL_NAME}:{name}", "created": int(time.time()), "owned_by": "QA team"}
+                    for name in shard_names
+                )
             return {"object": "list", "data": models}
 
         @app.post(
@@ -174,11 +262,21 @@ class WebServices:
             response_model=web_models.ChatCompletionResponse,
             dependencies=[Depends(RateLimiter(times=10, seconds=60)), Depends(verify_api_key)],
         )
-        async def chat_completions(request: web_models.ChatCompletionRequest):
+        async def chat_completions(request: web_models.ChatCompletionRequest, http_request: Request):
+            shard_names = self.__requested_shards(request.model, http_request)
+            # Only the shards the request is scoped to have to be loaded, a broken shard does not take the others down
+            self.__require_components("embedding_model", "tokenizer", "llm", *self.__aicoder.index_components(shard_names))
+            if not request.messages or request.messages[-1].role != "user":
+                raise HTTPException(status_code=400, detail="'messages' must end with a user message")
+            # The whole conversation is passed on: follow-up questions continue the KV cache of the previous turn
+            messages = [{"role": message.role, "content": message.content} for message in request.messages]
             try:
-                user_message = request.messages[0].content
-                content = self.__aicoder.ask_aicoder(user_message)
-                if content:
+                # Generation blocks for seconds, keep it off the event loop
+                result = await asyncio.to_thread(
+                    self.__profiler.run, self.__aicoder.chat_aicoder, messages, shard_names, request.max_tokens
+                )
+                if result:
+                    content, usage = result
                     return {
                         "id": str(uuid.uuid4()),
                         "object": "chat.completion",
@@ -191,15 +289,90 @@ class WebServices:
                                 "finish_reason": "stop",
                             }
                         ],
-                        "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
+                        "usage": usage,
                     }
             except Exception as e:
                 raise HTTPException(status_code=500, detail=str(e))
 
+        @app.post(
+            "/v1/embeddings",
+            response_model=web_models.EmbeddingResponse,
+            dependencies=[Depends(verify_api_key)],
+        )
+        async def create_embeddings(request: web_models.EmbeddingRequest):
+            # Only the embedding model is needed, embeddings are served before the LLM is loaded
+            self.__require_components("embedding_model")
+            texts = [request.input] if isinstance(request.input, str) else request.input
+            if not texts:
+                raise HTTPException(status_code=400, detail="'input' must not be empty")
+            if len(texts) > AICODER_EMBEDDING_MAX_INPUTS:
+                raise HTTPException(
+                    status_code=400, detail=f"'input' must not contain more than {AICODER_EMBEDDING_MAX_INPUTS} entries"
+                )
+            try:
+                vectors, prompt_tokens = await self.__embed_with_cache(texts)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+            if request.encoding_format == "base64":
+                embeddings = [base64.b64encode(vector.tobytes()).decode("ascii") for vector in vectors]
+            else:
+                # orjson serializes numpy arrays natively, no conversion to Python floats needed
+                embeddings = vectors
+            # Bypass response model validation, it is the dominant cost for large float arrays
+            return ORJSONResponse(
+                content={
+                    "object": "list",
+                    "data": [
+                        {"object": "embedding", "index": i, "embedding": embedding} for i, embedding in enumerate(embeddings)
+                    ],
+                    "model": request.model,
+                    "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+                },
+                status_code=status.HTTP_200_OK,
+            )
+
+        @app.post(
+            "/v1/search",
+            response_model=web_models.SearchResponse,
+            dependencies=[Depends(verify_api_key)],
+        )
+        async def search(request: web_models.SearchRequest, http_request: Request):
+            """Retrieval only: nearest code chunks for each query, without LLM generation"""
+            shard_names = self.__requested_shards(request.model, http_request)
+            self.__require_components("embedding_model", *self.__aicoder.index_components(shard_names))
+            queries = [request.query] if isinstance(request.query, str) else request.query
+            if not queries:
+                raise HTTPException(status_code=400, detail="'query' must not be empty")
+            if len(queries) > AICODER_SEARCH_MAX_QUERIES:
+                raise HTTPException(
+                    status_code=400, detail=f"'query' must not contain more than {AICODER_SEARCH_MAX_QUERIES} entries"
+                )
+            if not 1 <= request.k <= AICODER_SEARCH_MAX_K:
+                raise HTTPException(status_code=400, detail=f"'k' must be between 1 and {AICODER_SEARCH_MAX_K}")
+            start_time = time.perf_counter()
+            try:
+                results = await asyncio.to_thread(
+                    self.__profiler.run, self.__aicoder.search_aicoder, queries, request.k, shard_names
+                )
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+            return ORJSONResponse(
+                content={
+                    "object": "list",
+                    "data": [
+                        {"index": i, "query": query, "hits": hits} for i, (query, hits) in enumerate(zip(queries, results))
+                    ],
+                    "took_ms": (time.perf_counter() - start_time) * 1000,
+                },
+                status_code=status.HTTP_200_OK,
+            )
+
         @app.exception_handler(HTTPException)
         async def openai_error_handler(request, exc):
             return JSONResponse(
-                status_code=exc.status_code, content={"error": {"message": exc.detail, "type": "server_error"}}
+                status_code=exc.status_code,
+                content={"error": {"message": exc.detail, "type": "server_error"}},
+                headers=exc.headers,
             )
 
         @app.post(
@@ -209,10 +382,16 @@ class WebServices:
                 Depends(RateLimiter(times=1, seconds=10)),
             ],
         )
-        async def retrain_from_new_code():
-            response = self.__aicoder.retrain_aicoder()
+        async def retrain_from_new_code(http_request: Request, shard: Optional[str] = None):
+            """Rebuild the index of the given shards ("core,ran"), all of them by default"""
+            self.__require_components("embedding_model")
+            shard_names = self.__requested_shards(None, http_request, shard)
+            # Building an index takes long, keep the event loop (and the other shards) serving meanwhile
+            response = await asyncio.to_thread(self.__aicoder.retrain_aicoder, shard_names)
             if response:
-                return JSONResponse(content={"status": "OK"}, status_code=status.HTTP_200_OK)
+                return JSONResponse(
+                    content={"status": "OK", "build_stats": self.__aicoder.build_stats}, status_code=status.HTTP_200_OK
+                )
             else:
                 return JSONResponse(content={"status": "Not Found"}, status_code=status.HTTP_404_NOT_FOUND)
 
@@ -224,6 +403,25 @@ class WebServices:
             json_content = {"status": "ok"}
             return JSONResponse(content=json_content, status_code=status.HTTP_200_OK)
 
+        @app.get("/health/live", include_in_schema=False)
+        async def health_live():
+            """Liveness: the server answers and its startup has not failed (a failed shard index only degrades it)"""
+            failed = self.__aicoder.startup_status()["status"] == "failed"
+            return JSONResponse(
+                content={"status": "failed" if failed else "ok"},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE if failed else status.HTTP_200_OK,
+            )
+
+        @app.get("/health/ready", include_in_schema=False)
+        async def health_ready():
+            """Readiness: models and shard indexes loaded (or degraded), with the startup timing of each component"""
+            startup = self.__aicoder.startup_status()
+            ready = startup["status"] in ("ready", "degraded")
+            return JSONResponse(
+                content=startup,
+                status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+
         @app.get("/redis/all")
         async def get_all_redis_keys():
             """Get REDIS All Keys"""
@@ -284,30 +482,114 @@ class WebServices:
                 content={
                     "ips": ips,
                     "users": request_counts.currsize,
+                    "routes": self.__route_stats.snapshot(),
+                    "index": self.__aicoder.build_stats,
+                    "kv_cache": self.__aicoder.kv_cache_stats,
                 },
                 status_code=(status.HTTP_200_OK),
             )
 
-        # Middleware for logging requests
-        @app.middleware("http")
-        async def log_requests(request: Request, call_next):
-            uid = Utils().get_client_ip(request)
-            # Increment the request count for the client
-            value = request_counts.get(uid, 0)
-            if isinstance(value, tuple):
-                request_counts[uid] = (value[0] + 1, dt.datetime.now().isoformat())
+        def verify_debug_token(token: Optional[str] = Security(self.debug_token_header)):
+            # Without AICODER_DEBUG_TOKEN the debug endpoints do not exist
+            if not AICODER_DEBUG_TOKEN:
+                raise HTTPException(status_code=404, detail="Not Found")
+            if token is None or not secrets.compare_digest(token.encode(), AICODER_DEBUG_TOKEN.encode()):
+                raise HTTPException(status_code=403, detail="Invalid debug token")
+            return token
+
+        def profiling_session():
+            session = self.__profiler.session
+            if session is None:
+                raise HTTPException(status_code=404, detail="No profiling session")
+            return session
+
+        @app.post("/debug/profile", include_in_schema=False, dependencies=[Depends(verify_debug_token)])
+        async def start_profiling(
+            mode: str = "sample",
+            requests: Optional[int] = None,
+            seconds: Optional[float] = None,
+            interval_ms: float = 5.0,
+            all_threads: bool = False,
+        ):
+            """Profile the next requests (chat, search, embeddings) and/or a time window, 30s by default"""
+            if mode not in PROFILE_MODES:
+                raise HTTPException(status_code=400, detail=f"'mode' must be one of {', '.join(PROFILE_MODES)}")
+            if requests is None and seconds is None:
+                seconds = 30.0
+            if requests is not None and not 1 <= requests <= AICODER_PROFILE_MAX_REQUESTS:
+                raise HTTPException(status_code=400, detail=f"'requests' must be between 1 and {AICODER_PROFILE_MAX_REQUESTS}")
+            if seconds is not None and not 0 < seconds <= AICODER_PROFILE_MAX_SECONDS:
+                raise HTTPException(status_code=400, detail=f"'seconds' must be between 0 and {AICODER_PROFILE_MAX_SECONDS}")
+            if not 1 <= interval_ms <= 1000:
+                raise HTTPException(status_code=400, detail="'interval_ms' must be between 1 and 1000")
+            try:
+                session = self.__profiler.start(mode, requests, seconds, interval_ms / 1000, all_threads)
+            except ProfilingBusyError as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            return JSONResponse(content=session.status(), status_code=status.HTTP_202_ACCEPTED)
+
+        @app.get("/debug/profile", include_in_schema=False, dependencies=[Depends(verify_debug_token)])
+        async def profiling_status():
+            """Status of the current (or last) profiling session"""
+            return JSONResponse(content=profiling_session().status(), status_code=status.HTTP_200_OK)
+
+        @app.delete("/debug/profile", include_in_schema=False, dependencies=[Depends(verify_debug_token)])
+        async def stop_profiling():
+            """Finish the profiling session now, its result covers what was profiled so far"""
+            session = profiling_session()
+            session.finish()
+            return JSONResponse(content=session.status(), status_code=status.HTTP_200_OK)
+
+        @app.get("/debug/profile/result", include_in_schema=False, dependencies=[Depends(verify_debug_token)])
+        async def profiling_result():
+            """Collapsed stacks (sample) or pstats file (cprofile) of the finished profiling session"""
+            session = profiling_session()
+            if not session.done:
+                raise HTTPException(status_code=409, detail=f"Profiling session {session.id} is still running")
+            if session.mode == "sample":
+                filename, media_type = f"profile-{session.id}.collapsed", "text/plain"
             else:
-                request_counts[uid] = (1, dt.datetime.now().isoformat())
-            start_time = dt.datetime.now()
-            response = await call_next(request)
-            process_time = (dt.datetime.now() - start_time).total_seconds()
-            self.__access_logger.debug(
-                f"UID: {uid} - {request.method} {request.url.path}"
-                f"Status: {response.status_code} - Duration: {process_time:.4f}s"
+                filename, media_type = f"profile-{session.id}.pstats", "application/octet-stream"
+            return Response(
+                content=session.result(),
+                media_type=media_type,
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+            )
+
+        @app.post("/debug/profile/torch", include_in_schema=False, dependencies=[Depends(verify_debug_token)])
+        async def torch_profile(request: web_models.ChatCompletionRequest, http_request: Request):
+            """Answer one chat completion under the torch profiler and return its Chrome trace"""
+            shard_names = self.__requested_shards(request.model, http_request)
+            self.__require_components("embedding_model", "tokenizer", "llm", *self.__aicoder.index_components(shard_names))
+            if not request.messages or request.messages[-1].role != "user":
+                raise HTTPException(status_code=400, detail="'messages' must end with a user message")
+            messages = [{"role": message.role, "content": message.content} for message in request.messages]
+
+            def trace():
+                with tempfile.TemporaryDirectory(prefix="aicoder-trace-") as trace_folder:
+                    trace_file = os.path.join(trace_folder, "trace.json")
+                    self.__aicoder.trace_aicoder(messages, trace_file, shard_names, request.max_tokens)
+                    with open(trace_file, "rb") as f:
+                        return f.read()
+
+            try:
+                content = await asyncio.to_thread(trace)
+            except ProfilingBusyError as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+            return Response(
+                content=content,
+                media_type="application/json",
+                headers={"Content-Disposition": f'attachment; filename="trace-{int(time.time())}.json"'},
             )
-            # Update the user count using the cache's currsize property
-            return response
 
+        return app
+
+    def serve(self, app: FastAPI):
+        """
+        Serves the webapp with Hypercorn until shutdown.
+        """
         try:
             # Configure Hypercorn to listen single HTTP/1.1
             # Google Cloud Run, TLS termination happens at the load balancer level, not inside the container.
@@ -0,0 +1,147 @@
+"""
+Copyright 2025 5G-AICoder. All Rights Reserved.
+Author: Marios Karagiannopoulos <mkaragiannop@juniper.net>
+Module: Per-request overhead of the access log middleware, before (two BaseHTTPMiddleware layers and a
+synchronous FileHandler) and after (pure ASGI middleware and a queue-based JSON lines writer).
+
+The previous stack is measured as it ran ("previous": access log lines at DEBUG on an INFO logger, so never
+written) and writing one line per request like the current one ("previous_info").
+
+Usage: python benchmarks/bench_middleware.py [--requests 5000] [--concurrency 1]
+Requests go through httpx.ASGITransport, so only the application stack is measured, no sockets.
+"""
+
+# pylint: disable=logging-fstring-interpolation,too-many-statements
+
+import argparse
+import asyncio
+import datetime as dt
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from cachetools import TTLCache
+from fastapi import FastAPI, Request
+from starlette.middleware.base import BaseHTTPMiddleware
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "src"))
+
+from access_log import AccessLogMiddleware, RouteStats, start_access_logger  # noqa: E402
+from constants import LARGE_MAX_LRU_CACHE_SIZE, TTL_EXPIRATION_IN_SECS  # noqa: E402
+
+
+def bare_app():
+    app = FastAPI()
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": []}
+
+    return app
+
+
+class CacheControlMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        response = await call_next(request)
+        logging.getLogger().debug(f"response headers: {response.headers}")
+        return response
+
+
+def previous_app(log_folder, log_level=logging.DEBUG):
+    """
+    The middleware stack as it was: CacheControlMiddleware and the log_requests http middleware,
+    logging the access log lines at log_level (DEBUG, as it was, drops them).
+    """
+    app = bare_app()
+    # One logger and file per variant, so that each stack writes through a single FileHandler
+    name = f"access-previous-{logging.getLevelName(log_level).lower()}"
+    access_logger = logging.getLogger(name)
+    access_logger.setLevel(logging.INFO)
+    access_logger.propagate = False
+    access_file_handler = logging.FileHandler(os.path.join(log_folder, f"{name}.log"))
+    access_file_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    access_logger.addHandler(access_file_handler)
+    request_counts = TTLCache(maxsize=LARGE_MAX_LRU_CACHE_SIZE, ttl=TTL_EXPIRATION_IN_SECS)
+    app.add_middleware(CacheControlMiddleware)
+
+    @app.middleware("http")
+    async def log_requests(request: Request, call_next):
+        uid = request.client.host
+        value = request_counts.get(uid, 0)
+        if isinstance(value, tuple):
+            request_counts[uid] = (value[0] + 1, dt.datetime.now().isoformat())
+        else:
+            request_counts[uid] = (1, dt.datetime.now().isoformat())
+        start_time = dt.datetime.now()
+        response = await call_next(request)
+        process_time = (dt.datetime.now() - start_time).total_seconds()
+        access_logger.log(
+            log_level,
+            f"UID: {uid} - {request.method} {request.url.path} "
+            f"Status: {response.status_code} - Duration: {process_time:.4f}s"
+        )
+        return response
+
+    return app, None
+
+
+def current_app(log_folder):
+    app = bare_app()
+    access_logger, listener = start_access_logger(os.path.join(log_folder, "access.log"))
+    request_counts = TTLCache(maxsize=LARGE_MAX_LRU_CACHE_SIZE, ttl=TTL_EXPIRATION_IN_SECS)
+    app.add_middleware(
+        AccessLogMiddleware, access_logger=access_logger, route_stats=RouteStats(), request_counts=request_counts
+    )
+    return app, listener
+
+
+async def measure(app, requests, concurrency):
+    """
+    Mean wall time per request (µs) over `requests` requests, `concurrency` of them in flight at a time.
+    """
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(min(requests, 200)):  # warm up
+            await client.get("/v1/models")
+
+        async def worker(count):
+            for _ in range(count):
+                response = await client.get("/v1/models")
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(requests // concurrency) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return elapsed / (requests // concurrency * concurrency) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-request overhead of the access log middleware.")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as log_folder:
+        baseline = asyncio.run(measure(bare_app(), args.requests, args.concurrency))
+        results = {"requests": args.requests, "concurrency": args.concurrency, "bare_us_per_request": round(baseline, 1)}
+        stacks = (
+            ("previous", previous_app),
+            ("previous_info", lambda log_folder: previous_app(log_folder, logging.INFO)),
+            ("current", current_app),
+        )
+        for name, factory in stacks:
+            app, listener = factory(log_folder)
+            per_request = asyncio.run(measure(app, args.requests, args.concurrency))
+            if listener is not None:
+                listener.stop()
+            results[f"{name}_us_per_request"] = round(per_request, 1)
+            results[f"{name}_overhead_us"] = round(per_request - baseline, 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
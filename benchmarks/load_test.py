@@ -0,0 +1,263 @@
+"""
+Copyright 2025 5G-AICoder. All Rights Reserved.
+Author: Marios Karagiannopoulos <mkaragiannop@juniper.net>
+Module: End-to-end load test of the AICoder WebServices.
+
+Boots the app (benchmarks/stub_server.py: production routes and middleware, deterministic stub models,
+fakeredis) under Hypercorn in a subprocess, over a generated corpus, then drives concurrent load through
+/redis/all, /v1/search and /v1/chat/completions (conversations of up to three questions). Reports, per scenario,
+RPS, latency percentiles and the event loop lag of the server as JSON (and for chat, the share of prompt tokens
+served from the KV prefix cache), a machine readable baseline to compare runs against.
+
+Usage: python benchmarks/load_test.py [--duration 10] [--concurrency 16] [--output baseline.json]
+Requires the app requirements plus benchmarks/requirements.txt.
+"""
+
+# pylint: disable=logging-fstring-interpolation,too-many-statements
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+STUB_SERVER = os.path.join(BENCHMARKS_FOLDER, "stub_server.py")
+sys.path.insert(0, os.path.join(BENCHMARKS_FOLDER, "..", "app", "src"))
+
+from constants import OPENAI_API_KEY, AICODER_MODEL_NAME  # noqa: E402
+
+# Redis first: each chat completion leaves a rate limiter key behind, which /redis/all would list
+SCENARIOS = ("redis", "search", "chat")
+WORDS = (
+    "session", "pdu", "nssai", "slice", "amf", "smf", "upf", "policy", "qos", "flow", "bearer", "handover",
+    "registration", "subscriber", "context", "tunnel", "packet", "charging", "paging", "timer",
+)
+QUESTIONS = (
+    "Which function implements NSSAI selection?",
+    "How is a PDU session released after the inactivity timer expires?",
+    "Where are QoS flows mapped to bearers during handover?",
+    "What happens when the subscriber context is not found?",
+    "How does the UPF tunnel forward packets for a slice?",
+)
+
+
+def generate_corpus(repo_path, num_files, seed=5):
+    """
+    Deterministic synthetic repository of Python and C files with named functions.
+    Returns some of the function names, used as symbol queries.
+    """
+    rng = random.Random(seed)
+    symbols = []
+    for n in range(num_files):
+        folder = os.path.join(repo_path, rng.choice(WORDS))
+        os.makedirs(folder, exist_ok=True)
+        python = n % 2 == 0
+        lines = []
+        for m in range(8):
+            words = rng.sample(WORDS, 3)
+            name = f"{'_'.join(words)}_{n}_{m}"
+            symbols.append(name)
+            body = " ".join(rng.choice(WORDS) for _ in range(30))
+            if python:
+                docstring = f'    """Handle the {" ".join(words)}: {body}"""'
+                lines += [f"def {name}(ctx, {words[0]}):", docstring, "    return ctx", ""]
+            else:
+                lines += [f"int {name}(struct ctx *ctx, int {words[0]})", "{", f"    /* {body} */", "    return 0;", "}", ""]
+        with open(os.path.join(folder, f"module_{n}.{'py' if python else 'c'}"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+    return symbols[::37]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def scenario_request(scenario, n, symbols, history=()):
+    """
+    Method, path, JSON body and headers of the n-th request of a scenario.
+    Chat questions follow the history of the conversation they continue.
+    """
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Service-Name": "load-test"}
+    if scenario == "redis":
+        return "GET", "/redis/all", None, headers
+    if scenario == "search":
+        # Alternate natural language (dense and lexical retrieval) and symbol (fast path) queries
+        query = QUESTIONS[n % len(QUESTIONS)] if n % 2 else symbols[n % len(symbols)]
+        return "POST", "/v1/search", {"query": query, "k": 5}, headers
+    # The rate limiter allows 10 chat completions a minute per Service-Name: one name per request
+    headers["Service-Name"] = f"load-test-{uuid.uuid4().hex}"
+    messages = list(history) + [{"role": "user", "content": QUESTIONS[n % len(QUESTIONS)]}]
+    return "POST", "/v1/chat/completions", {"model": AICODER_MODEL_NAME, "messages": messages}, headers
+
+
+async def run_scenario(client, scenario, symbols, duration, concurrency):
+    """
+    `concurrency` workers send requests back to back for `duration` seconds.
+    """
+    latencies = []
+    status_codes = {}
+    prompt_tokens = {"total": 0, "cached": 0}
+    counter = iter(range(sys.maxsize))
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        history = []
+        while time.perf_counter() < deadline:
+            method, path, body, headers = scenario_request(scenario, next(counter), symbols, history)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body, headers=headers)
+                code = str(response.status_code)
+            except httpx.HTTPError as e:
+                code = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            status_codes[code] = status_codes.get(code, 0) + 1
+            # Conversations of up to three questions, follow-ups continue the KV cache of the previous turn
+            history = []
+            if scenario == "chat" and code == "200":
+                result = response.json()
+                prompt_tokens["total"] += result["usage"]["prompt_tokens"]
+                prompt_tokens["cached"] += result["usage"]["prompt_tokens_details"]["cached_tokens"]
+                if len(body["messages"]) < 5:
+                    history = body["messages"] + [{"role": "assistant", "content": result["choices"][0]["message"]["content"]}]
+
+    await client.get("/bench/loop-lag", params={"reset": True})
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    loop_lag = (await client.get("/bench/loop-lag", params={"reset": True})).json()
+
+    latencies.sort()
+    errors = sum(count for code, count in status_codes.items() if not code.startswith("2"))
+    report = {
+        "requests": len(latencies),
+        "errors": errors,
+        "status_codes": status_codes,
+        "rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3),
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3),
+        },
+        "loop_lag_ms": loop_lag,
+    }
+    if prompt_tokens["total"]:
+        report["prompt_tokens_cached_pct"] = round(prompt_tokens["cached"] / prompt_tokens["total"] * 100, 1)
+    return report
+
+
+async def wait_until_ready(client, server, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"The server exited with code {server.returncode} before being ready")
+        try:
+            if (await client.get("/health/ready")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"The server was not ready after {timeout}s")
+
+
+async def run_load(args, base_url, symbols, server):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        await wait_until_ready(client, server, args.startup_timeout)
+        # Warm up every route once (lazy imports, first FAISS search)
+        for scenario in SCENARIOS:
+            method, path, body, headers = scenario_request(scenario, 0, symbols)
+            await client.request(method, path, json=body, headers=headers)
+        results = {}
+        for scenario in args.scenarios.split(","):
+            results[scenario] = await run_scenario(client, scenario, symbols, args.duration, args.concurrency)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the AICoder WebServices with stub models.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated, among: " + ", ".join(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight")
+    parser.add_argument("--files", type=int, default=200, help="Files in the generated corpus")
+    parser.add_argument("--generation-ms", type=float, default=50.0, help="Simulated LLM generation time per chat")
+    parser.add_argument("--redis-keys", type=int, default=100, help="Keys seeded in Redis, listed by /redis/all")
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    for scenario in args.scenarios.split(","):
+        if scenario not in SCENARIOS:
+            parser.error(f"Unknown scenario '{scenario}'")
+
+    with tempfile.TemporaryDirectory(prefix="aicoder-load-test-") as workdir:
+        symbols = generate_corpus(os.path.join(workdir, "repo"), args.files)
+        port = free_port()
+        env = dict(
+            os.environ,
+            AICODER_5GCODE_PATH=os.path.join(workdir, "repo"),
+            AICODER_5GCODE_EXTENSIONS=".py,.c",
+            AICODER_5GCODE_SHARDS="",
+            AICODER_FAISS_INDEX_FOLDER=os.path.join(workdir, "faiss"),
+            AICODER_INDEX_BUILD_ON_STARTUP="true",
+            AICODER_ACCESS_LOG_FILE=os.path.join(workdir, "access.log"),
+        )
+        env.setdefault("AICODER_LOGLEVEL", "WARNING")
+        command = [
+            sys.executable, STUB_SERVER, "--port", str(port),
+            "--generation-ms", str(args.generation_ms), "--redis-keys", str(args.redis_keys),
+        ]
+        with open(os.path.join(workdir, "server.log"), "w", encoding="utf-8") as server_log:
+            server = subprocess.Popen(command, env=env, cwd=workdir, stdout=server_log, stderr=subprocess.STDOUT)
+            try:
+                results = asyncio.run(run_load(args, f"http://127.0.0.1:{port}", symbols, server))
+            except Exception:
+                with open(os.path.join(workdir, "server.log"), encoding="utf-8") as f:
+                    sys.stderr.write(f.read()[-4000:])
+                raise
+            finally:
+                server.send_signal(signal.SIGINT)
+                try:
+                    server.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+
+    report = {
+        "config": {
+            "duration_s": args.duration,
+            "concurrency": args.concurrency,
+            "files": args.files,
+            "generation_ms": args.generation_ms,
+            "redis_keys": args.redis_keys,
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "scenarios": results,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Copyright 2025 5G-AICoder. All Rights Reserved.
+Author: Marios Karagiannopoulos <mkaragiannop@juniper.net>
+Module: The AICoder WebServices app with a deterministic stub LLM, tokenizer and embedding model and an in-process
+Redis (fakeredis), for load testing. Started by benchmarks/load_test.py, which sets the AICODER_* environment
+(corpus, index folder, access log) before this module imports the app.
+
+Everything but the models and Redis is the production code: routes, middleware, rate limiter, retrieval
+over a real FAISS index of the corpus, chat template rendering, prompt truncation and the KV prefix cache.
+GET /bench/loop-lag reports the event loop lag seen meanwhile.
+"""
+
+# pylint: disable=logging-fstring-interpolation,too-many-statements
+
+import argparse
+import asyncio
+import logging
+import os
+import re
+import sys
+import time
+import zlib
+
+from types import SimpleNamespace
+
+import fakeredis
+import numpy as np
+import torch
+
+from transformers import DynamicCache
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "src"))
+
+from constants import AICODER_LOGLEVEL, LUA_REDIS_SCRIPT  # noqa: E402
+from aicoder import AICoder  # noqa: E402
+from redis_cache import RedisCache  # noqa: E402
+from web_services import WebServices  # noqa: E402
+
+logger = logging.getLogger()
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+
+
+class StubEmbeddingModel:
+    """
+    Deterministic stand-in for the SentenceTransformer: normalized bag of hashed tokens.
+    Same interface as used by AICoder and IndexBuilder, microseconds per text instead of a transformer pass.
+    """
+
+    max_seq_length = 384
+
+    def __init__(self, dim=768):
+        self.__dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.__dim
+
+    def tokenizer(self, texts, add_special_tokens=True, truncation=False, max_length=None, **kwargs):
+        edges = [0] if add_special_tokens else []
+        input_ids = [edges + [zlib.crc32(token.encode()) for token in TOKEN_PATTERN.findall(text)] + edges for text in texts]
+        if truncation and max_length:
+            input_ids = [ids[:max_length] for ids in input_ids]
+        return {"input_ids": input_ids}
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, show_progress_bar=False):
+        embeddings = np.zeros((len(texts), self.__dim), dtype=np.float32)
+        for row, text in zip(embeddings, texts):
+            for token in TOKEN_PATTERN.findall(text.lower()):
+                row[zlib.crc32(token.encode()) % self.__dim] += 1.0
+            norm = np.linalg.norm(row)
+            if norm:
+                row /= norm
+        return embeddings
+
+
+class StubTokenizer:
+    """
+    Stand-in for the LLM tokenizer: one token per word, with a chat template, so that prompts are rendered,
+    truncated and matched against the KV prefix cache like with the real one.
+    """
+
+    chat_template = "stub"
+    eos_token_id = 0
+
+    def __init__(self):
+        self.__words = {}  # token id -> word, to decode
+
+    def __encode(self, text):
+        token_ids = []
+        for word in TOKEN_PATTERN.findall(text):
+            token_id = zlib.crc32(word.encode()) or 1
+            self.__words.setdefault(token_id, word)
+            token_ids.append(token_id)
+        return token_ids
+
+    def apply_chat_template(self, messages, add_generation_prompt=True, return_tensors="pt", return_dict=False):
+        text = "".join(f"<|{message['role']}|>\n{message['content']}\n" for message in messages)
+        if add_generation_prompt:
+            text += "<|assistant|>\n"
+        return torch.tensor([self.__encode(text)])
+
+    def __call__(self, text, return_tensors="pt"):
+        return SimpleNamespace(input_ids=torch.tensor([self.__encode(text)]))
+
+    def decode(self, token_ids, skip_special_tokens=True):
+        return " ".join(self.__words.get(int(token_id), "") for token_id in token_ids)
+
+
+class StubLLM:
+    """
+    Stand-in for the LLM generate(): sleeps for a fixed time and answers with the last words of the prompt
+    tokens it was not given a KV cache for (the question). It fills a small DynamicCache (one layer, one head) for every token
+    it sees, so that the KV prefix cache is taken, cropped and stored like with the real model.
+    """
+
+    dtype = torch.float32
+
+    def __init__(self, generation_ms, response_tokens=32):
+        self.config = SimpleNamespace(num_hidden_layers=1, num_attention_heads=1, hidden_size=8)
+        self.__generation_ms = generation_ms
+        self.__response_tokens = response_tokens
+
+    def generate(self, input_ids, past_key_values=None, max_new_tokens=None, return_dict_in_generate=True, **kwargs):
+        cache = past_key_values if past_key_values is not None else DynamicCache()
+        prefill = input_ids[0, cache.get_seq_length() :]
+        response = prefill[-min(self.__response_tokens, max_new_tokens or self.__response_tokens, len(prefill)) :]
+        time.sleep(self.__generation_ms / 1000)
+        # Like generate(), the last token produced is never fed back, so the cache stops just before it
+        new_tokens = len(prefill) + len(response) - 1
+        states = torch.zeros((1, self.config.num_attention_heads, new_tokens, self.config.hidden_size), dtype=self.dtype)
+        cache.update(states, states.clone(), 0)
+        return SimpleNamespace(sequences=torch.cat([input_ids, response[None]], dim=1), past_key_values=cache)
+
+
+class StubAICoder(AICoder):
+    """
+    AICoder with the stub embedding model, tokenizer and LLM. Everything else runs for real: retrieval,
+    prompt rendering and truncation, the KV prefix cache; generation sleeps off the event loop like the real one.
+    """
+
+    def __init__(self, generation_ms):
+        self.__generation_ms = generation_ms
+        super().__init__()
+
+    def _create_embedding_model(self):
+        return StubEmbeddingModel()
+
+    def _create_tokenizer(self):
+        return StubTokenizer()
+
+    def _create_llm(self):
+        return StubLLM(self.__generation_ms)
+
+
+class FakeRedisCache(RedisCache):
+    """
+    RedisCache on an in-process fakeredis server (with Lua, for the rate limiter), seeded with some keys.
+    """
+
+    def __init__(self, seed_keys):
+        super().__init__()
+        self.__seed_keys = seed_keys
+
+    async def connect_to_redis(self):
+        if self._redis_client is None:
+            self._redis_client = fakeredis.aioredis.FakeRedis()
+            self._get_key_with_hits = self._redis_client.register_script(LUA_REDIS_SCRIPT)
+            for n in range(self.__seed_keys):
+                await self._redis_client.set(f"bench:key:{n}", f'{{"value": {n}}}', ex=3600)
+        return self._redis_client
+
+
+class LoopLagMonitor:
+    """
+    Samples how late the event loop wakes up a task sleeping for a fixed interval.
+    """
+
+    def __init__(self, interval=0.01):
+        self.__interval = interval
+        self.__samples = []
+        self.__task = None
+
+    async def __run(self):
+        # perf_counter rather than loop.time(), which uvloop rounds to milliseconds
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.__interval)
+            self.__samples.append(time.perf_counter() - start - self.__interval)
+
+    def report(self, reset):
+        if self.__task is None:
+            self.__task = asyncio.get_running_loop().create_task(self.__run())
+        samples = sorted(self.__samples)
+        if reset:
+            self.__samples = []
+        if not samples:
+            return {"samples": 0}
+        return {
+            "samples": len(samples),
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+            "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+            "max_ms": round(samples[-1] * 1000, 3),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve AICoder with stub models and fakeredis for load testing.")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--generation-ms", type=float, default=50.0, help="Simulated LLM generation time per chat")
+    parser.add_argument("--redis-keys", type=int, default=100, help="Keys seeded in Redis, listed by /redis/all")
+    args = parser.parse_args()
+
+    logger.setLevel(AICODER_LOGLEVEL)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s - [%(threadName)s]: %(levelname)s - %(module)s - %(message)s"))
+    logger.addHandler(handler)
+
+    web_services = WebServices(args.port, FakeRedisCache(args.redis_keys), StubAICoder(args.generation_ms))
+    app = web_services.build_app()
+    monitor = LoopLagMonitor()
+
+    @app.get("/bench/loop-lag", include_in_schema=False)
+    async def loop_lag(reset: bool = False):
+        """Event loop lag since the last reset, the first call starts the monitor"""
+        return monitor.report(reset)
+
+    web_services.serve(app)
+
+
+if __name__ == "__main__":
+    main()